@@ -0,0 +1,109 @@
+"""
+Import time benchmark of the integration.
+
+Imports custom_components.mercedesmeapi in a fresh interpreter with
+python -X importtime. The Home Assistant modules that are loaded at boot
+anyway are imported first, so the result is the time the integration adds
+to the boot. Also lists the heavy dependencies the import pulled in.
+
+With --history FILE the result is appended as one JSON line (date, git
+revision, times), to track the import time over time.
+
+Run from the repository root:
+    python benchmarks/import_benchmark.py [--history benchmarks/import_times.jsonl]
+"""
+import argparse
+import datetime
+import json
+import statistics
+import subprocess
+import sys
+from os.path import abspath, dirname
+
+ROOT = dirname(dirname(abspath(__file__)))
+PACKAGE = "custom_components.mercedesmeapi"
+REPEAT = 7
+
+# loaded by Home Assistant before any integration is set up
+PRELOADED = [
+    "voluptuous",
+    "homeassistant.core",
+    "homeassistant.const",
+    "homeassistant.helpers.aiohttp_client",
+    "homeassistant.helpers.config_validation",
+    "homeassistant.helpers.dispatcher",
+    "homeassistant.helpers.entity",
+    "homeassistant.helpers.event",
+]
+
+MARKER = "-- preloaded --"
+
+# must not be imported by the setup of the integration
+HEAVY_MODULES = ["requests", "lxml", "aiohttp", "multiprocessing"]
+
+
+def measure_import():
+    """ import the integration once, returns {module: cumulative us}."""
+    code = (
+        f"import sys; sys.path.insert(0, {ROOT!r}); "
+        + "".join(f"import {module}; " for module in PRELOADED)
+        + f"sys.stderr.write({MARKER!r} + '\\n'); sys.stderr.flush(); "
+        + f"import {PACKAGE}"
+    )
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            stderr=subprocess.PIPE, universal_newlines=True,
+                            check=True)
+
+    times = {}
+    lines = result.stderr.splitlines()
+    for line in lines[lines.index(MARKER) + 1:]:
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        times[module.strip()] = int(cumulative)
+    return times
+
+
+def get_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              cwd=ROOT, stdout=subprocess.PIPE,
+                              universal_newlines=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--history",
+                        help="append the result as a JSON line to the file")
+    args = parser.parse_args()
+
+    runs = [measure_import() for _ in range(REPEAT)]
+    total = statistics.median(run[PACKAGE] for run in runs) / 1000
+    modules = {module: statistics.median(run.get(module, 0) for run in runs)
+               / 1000
+               for module in runs[0]
+               if module.startswith(PACKAGE + ".")}
+    heavy = [module for module in HEAVY_MODULES if module in runs[0]]
+
+    print(f"{PACKAGE}: {total:8.1f} ms")
+    for module, ms in sorted(modules.items(), key=lambda item: -item[1]):
+        print(f"  {module:<45} {ms:8.1f} ms")
+    print(f"heavy dependencies imported: {', '.join(heavy) or 'none'}")
+
+    if args.history:
+        with open(args.history, "a") as history:
+            history.write(json.dumps({
+                "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                "revision": get_revision(),
+                "python": sys.version.split()[0],
+                "total_ms": total,
+                "modules_ms": modules,
+                "heavy": heavy,
+            }) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Microbenchmark of the dynamic payload parsing per car.
+
+Compares the former parsing (one _get_car_values loop per category, a new
+object per category and attribute) with the single pass into the
+FleetStore, for the parse time per car and the memory of a whole fleet.
+
+Run from the repository root, Home Assistant is not needed:
+    python benchmarks/parse_benchmark.py
+"""
+import itertools
+import sys
+import timeit
+import tracemalloc
+import types
+from os.path import abspath, dirname, join
+
+# load the controller modules without the package __init__, it imports
+# Home Assistant
+_package = types.ModuleType("mercedesmeapi")
+_package.__path__ = [join(dirname(dirname(abspath(__file__))),
+                          "custom_components", "mercedesmeapi")]
+sys.modules["mercedesmeapi"] = _package
+
+from mercedesmeapi.apicontroller import (  # noqa: E402
+    DYNAMIC_CATEGORIES,
+    STORE_CATEGORIES,
+    set_category_values,
+)
+from mercedesmeapi.store import FleetStore  # noqa: E402
+
+NUMBER = 2000
+FLEET_SIZE = 40
+
+# store and slot of store_parse, built in main()
+store = None
+slot = None
+
+
+class CarAttribute(object):
+    def __init__(self, value, retrievalstatus, timestamp):
+        self.value = value
+        self.retrievalstatus = retrievalstatus
+        self.timestamp = timestamp
+
+
+class Category(object):
+    def __init__(self, name):
+        self.name = name
+
+
+def build_payload(value="1", vtime=1596240000):
+    """ a payload with every known key and a few unknown ones."""
+    payload = {"vtime": vtime}
+    for _, options, _ in DYNAMIC_CATEGORIES.values():
+        for option in options:
+            payload[option] = {"value": value, "status": "VALID"}
+    for index in range(40):
+        payload[f"unknown{index}"] = {"value": "1", "status": "VALID"}
+    return payload
+
+
+def legacy_get_car_values(car_detail, classInstance, options):
+    """ the parsing of the former Controller._get_car_values."""
+    for option in options:
+        if car_detail is not None:
+            curr = car_detail.get(option)
+            if curr is not None:
+                curr_status = CarAttribute(
+                    curr.get("value"),
+                    curr.get("status"),
+                    car_detail.get("vtime")
+                )
+            else:
+                curr_status = CarAttribute(0, 4, 0)
+            setattr(classInstance, option, curr_status)
+        else:
+            setattr(classInstance, option, CarAttribute(-1, -1, None))
+
+    return classInstance
+
+
+def legacy_parse(payload):
+    return {category: legacy_get_car_values(payload, Category(name), options)
+            for category, (name, options, _) in DYNAMIC_CATEGORIES.items()}
+
+
+def store_parse(payload):
+    """ the payloads alternate, every call writes a changed row."""
+    set_category_values(store, slot, payload, DYNAMIC_CATEGORIES)
+
+
+def fleet_memory(parse_fleet, payload):
+    tracemalloc.start()
+    fleet = parse_fleet(payload)  # noqa: F841
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size
+
+
+def legacy_fleet(payload):
+    return [legacy_parse(payload) for _ in range(FLEET_SIZE)]
+
+
+def store_fleet(payload):
+    store = FleetStore(STORE_CATEGORIES)
+    for index in range(FLEET_SIZE):
+        slot = store.add_car(f"WDD{index:013}")
+        set_category_values(store, slot, payload, DYNAMIC_CATEGORIES)
+    return store
+
+
+def main():
+    global store, slot
+    store = FleetStore(STORE_CATEGORIES)
+    slot = store.add_car("WDD0000000000001")
+
+    payload = build_payload()
+    # an unchanged payload is a no-op for the store, alternate two payloads
+    # so that every parse writes a new row
+    payloads = itertools.cycle([payload, build_payload("2", 1596240060)])
+
+    for name, parse, parse_fleet in [
+            ("per category", legacy_parse, legacy_fleet),
+            ("store", store_parse, store_fleet)]:
+        best = min(timeit.repeat(lambda: parse(next(payloads)),
+                                 number=NUMBER, repeat=5))
+        memory = fleet_memory(parse_fleet, payload)
+        print(f"{name:>12}: {best / NUMBER * 1e6:8.1f} us per car, "
+              f"{memory / 1024:8.1f} KiB for {FLEET_SIZE} cars")
+
+
+if __name__ == "__main__":
+    main()
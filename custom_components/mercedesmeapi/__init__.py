@@ -5,7 +5,10 @@ For more details about this component, please refer to the documentation at
 https://github.com/ReneNulschDE/mbapipy/
 """
 import logging
+import time
 from datetime import timedelta
+from functools import partial
+from operator import attrgetter
 
 import voluptuous as vol
 
@@ -14,16 +17,33 @@ from homeassistant.const import (
     CONF_PASSWORD,
     CONF_SCAN_INTERVAL,
     CONF_USERNAME,
+    EVENT_HOMEASSISTANT_STOP,
     LENGTH_KILOMETERS,
     LENGTH_MILES,
 )
+from homeassistant.core import callback
 from homeassistant.helpers import discovery, config_validation as cv
-from homeassistant.helpers.dispatcher import dispatcher_send
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.helpers.dispatcher import (
+    async_dispatcher_connect,
+    async_dispatcher_send,
+)
 from homeassistant.helpers.entity import Entity
-from homeassistant.helpers.event import track_time_interval
+from homeassistant.helpers.event import (
+    async_call_later,
+    async_track_time_interval,
+)
 from homeassistant.util import slugify
 
-from .apicontroller import Controller
+from .apicontroller import (
+    CATEGORIES,
+    DEFAULT_DISCOVERY_INTERVAL,
+    DEFAULT_FEATURE_TTL,
+    DEFAULT_FORCE_REFRESH_INTERVAL,
+    DEFAULT_STALE_THRESHOLD,
+    Controller,
+)
+from .commands import COMMAND_FAILED, COMMAND_SUCCESS, COMMAND_TIMEOUT
 from .oauth import MercedesMeOAuth
 from .const import MERCEDESME_COMPONENTS
 
@@ -37,12 +57,61 @@ CONF_SAVE_CAR_DETAILS = "save_car_details"
 CONF_TIRE_WARNING_INDICATOR = "tire_warning"
 CONF_CARS = "cars"
 CONF_CARS_VIN = "vin"
+CONF_MAX_WORKERS = "max_workers"
+CONF_ASYNC_API = "async_api"
+CONF_IDLE_SCAN_INTERVAL = "idle_scan_interval"
+CONF_REFRESH_TTL = "refresh_ttl"
+CONF_FORCE_REFRESH_INTERVAL = "force_refresh_interval"
+CONF_STALE_THRESHOLD = "stale_threshold"
+CONF_FEATURE_TTL = "feature_ttl"
+CONF_DISCOVERY_INTERVAL = "discovery_interval"
 
 DEFAULT_CACHE_PATH = ".mercedesme-token-cache"
 DEFAULT_NAME = "Mercedes ME"
 DOMAIN = "mercedesmeapi"
 
+# fleet signal with {vin: change set} of all changed cars
 SIGNAL_UPDATE_MERCEDESME = "mercedesmeapi_update"
+# car signal with the change set of the car
+SIGNAL_UPDATE_CAR = "mercedesmeapi_update_{}"
+# car signal with a started or done command of the car
+SIGNAL_COMMAND_CAR = "mercedesmeapi_command_{}"
+# signal with the vin and the activated features of a car, the platforms
+# add the entities of the features, all entities of a new car for None
+SIGNAL_ADD_ENTITIES = "mercedesmeapi_add_entities"
+# car signal, the car was removed from the account
+SIGNAL_REMOVE_CAR = "mercedesmeapi_remove_{}"
+
+# fired when a command is done, data: vin, action, status
+EVENT_COMMAND = "mercedesmeapi_command"
+
+# max seconds between a successful command and the car state that
+# confirms it
+OPTIMISTIC_STATE_TIMEOUT = 60
+
+SERVICE_BATCH_COMMAND = "batch_command"
+ATTR_COMMAND = "command"
+ATTR_CARS = "cars"
+
+BATCH_COMMANDS = [
+    "lock",
+    "unlock",
+    "heater_on",
+    "heater_off",
+    "climate_on",
+    "climate_off",
+    "remote_start_on",
+    "remote_start_off",
+]
+
+BATCH_COMMAND_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_COMMAND): vol.In(BATCH_COMMANDS),
+        vol.Optional(ATTR_CARS, default=["all"]): vol.All(
+            cv.ensure_list, [cv.string]
+        ),
+    }
+)
 
 CARS_SCHEMA = vol.Schema(
     {
@@ -54,6 +123,10 @@ CARS_SCHEMA = vol.Schema(
     }
 )
 
+REFRESH_TTL_SCHEMA = vol.Schema(
+    {vol.Optional(category): cv.positive_int for category in CATEGORIES}
+)
+
 CONFIG_SCHEMA = vol.Schema(
     {
         DOMAIN: vol.Schema(
@@ -71,6 +144,25 @@ CONFIG_SCHEMA = vol.Schema(
                 vol.Optional(CONF_PIN): cv.string,
                 vol.Optional(CONF_SAVE_CAR_DETAILS, default=False): cv.boolean,
                 vol.Optional(CONF_CARS): [CARS_SCHEMA],
+                vol.Optional(CONF_MAX_WORKERS, default=4): vol.All(
+                    cv.positive_int, vol.Range(min=1, max=32)
+                ),
+                vol.Optional(CONF_ASYNC_API, default=False): cv.boolean,
+                vol.Optional(CONF_IDLE_SCAN_INTERVAL, default=1800): cv.positive_int,
+                vol.Optional(CONF_REFRESH_TTL, default={}): REFRESH_TTL_SCHEMA,
+                vol.Optional(
+                    CONF_FORCE_REFRESH_INTERVAL,
+                    default=DEFAULT_FORCE_REFRESH_INTERVAL
+                ): cv.positive_int,
+                vol.Optional(
+                    CONF_STALE_THRESHOLD, default=DEFAULT_STALE_THRESHOLD
+                ): cv.positive_int,
+                vol.Optional(
+                    CONF_FEATURE_TTL, default=DEFAULT_FEATURE_TTL
+                ): cv.positive_int,
+                vol.Optional(
+                    CONF_DISCOVERY_INTERVAL, default=DEFAULT_DISCOVERY_INTERVAL
+                ): cv.positive_int,
             }
         )
     },
@@ -78,7 +170,7 @@ CONFIG_SCHEMA = vol.Schema(
 )
 
 
-def setup(hass, config):
+async def async_setup(hass, config):
     """Set up MercedesMe System."""
 
     conf = config[DOMAIN]
@@ -95,11 +187,12 @@ def setup(hass, config):
         cache,
     )
 
-    token_info = auth_handler.get_cached_token()
+    token_info = await hass.async_add_executor_job(auth_handler.get_cached_token)
 
     if not token_info:
         _LOGGER.debug("no token; requesting authorization")
-        token_info = auth_handler.request_initial_token()
+        token_info = await hass.async_add_executor_job(
+            auth_handler.request_initial_token)
     else:
         _LOGGER.debug("cached token found")
 
@@ -107,7 +200,7 @@ def setup(hass, config):
         _LOGGER.warning("no token; authorization failed; check debug log")
         return False
 
-    mercedesme_api = Controller(
+    controller_args = (
         auth_handler,
         scan_interval,
         conf.get(CONF_ACCEPT_LANG),
@@ -117,21 +210,131 @@ def setup(hass, config):
         conf.get(CONF_PIN),
         hass.config.path(""),
     )
+    controller_options = {
+        "max_workers": conf.get(CONF_MAX_WORKERS),
+        "idle_update_interval": conf.get(CONF_IDLE_SCAN_INTERVAL),
+        "category_ttl": conf.get(CONF_REFRESH_TTL),
+        "force_refresh_interval": conf.get(CONF_FORCE_REFRESH_INTERVAL),
+        "stale_threshold": conf.get(CONF_STALE_THRESHOLD),
+        "warm_start": True,
+        "feature_ttl": conf.get(CONF_FEATURE_TTL),
+    }
+
+    if conf.get(CONF_ASYNC_API):
+        from .asynccontroller import AsyncController
+
+        mercedesme_api = AsyncController(
+            *controller_args,
+            session=async_get_clientsession(hass),
+            **controller_options)
+        await mercedesme_api.async_init()
+    else:
+        mercedesme_api = await hass.async_add_executor_job(
+            partial(Controller, *controller_args, **controller_options))
 
     hass.data[DOMAIN] = MercedesMeHub(mercedesme_api, conf)
 
+    @callback
+    def async_stop(event):
+        """Stop the background token refresh with Home Assistant."""
+        mercedesme_api.stop()
+
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, async_stop)
+
+    def loop_listener(listener):
+        """Run a listener called by the threaded Controller in the loop."""
+        if mercedesme_api.is_async:
+            return listener
+        return lambda *args: hass.add_job(listener, *args)
+
+    @callback
+    def async_dispatch_changes(changed_cars):
+        """Signal the changed cars to their entities."""
+        async_dispatcher_send(hass, SIGNAL_UPDATE_MERCEDESME, changed_cars)
+        for vin, changed in changed_cars.items():
+            async_dispatcher_send(hass, SIGNAL_UPDATE_CAR.format(vin), changed)
+
+    @callback
+    def async_dispatch_command(command):
+        """Signal a command to the entities and fire the done event."""
+        async_dispatcher_send(
+            hass, SIGNAL_COMMAND_CAR.format(command.car_id), command)
+        if command.is_done:
+            hass.bus.async_fire(EVENT_COMMAND, {
+                "vin": command.car_id,
+                "action": command.action,
+                "status": command.status,
+            })
+
+    @callback
+    def async_dispatch_features(new_features):
+        """Signal the activated features to the platforms."""
+        for vin, features in new_features.items():
+            async_dispatcher_send(hass, SIGNAL_ADD_ENTITIES, vin, features)
+
+    @callback
+    def async_dispatch_cars(added, removed):
+        """Signal the added and removed cars to the platforms."""
+        for vin in added:
+            async_dispatcher_send(hass, SIGNAL_ADD_ENTITIES, vin, None)
+        for vin in removed:
+            async_dispatcher_send(hass, SIGNAL_REMOVE_CAR.format(vin))
+
+    mercedesme_api.add_update_listener(loop_listener(async_dispatch_changes))
+    mercedesme_api.add_feature_listener(loop_listener(async_dispatch_features))
+    mercedesme_api.add_car_listener(loop_listener(async_dispatch_cars))
+    mercedesme_api.commands.add_listener(loop_listener(async_dispatch_command))
+
     for component in MERCEDESME_COMPONENTS:
         hass.async_create_task(
             discovery.async_load_platform(hass, component, DOMAIN, {}, config)
         )
 
-    def hub_refresh(event_time):
+    # the entities were created out of the snapshot of the last run, ask
+    # the API without blocking the startup
+    if mercedesme_api.is_warm:
+        if mercedesme_api.is_async:
+            hass.async_create_task(mercedesme_api.async_revalidate())
+        else:
+            hass.async_add_job(mercedesme_api.revalidate)
+
+    async def hub_refresh(event_time):
         """Call Mercedes me API to refresh information."""
         _LOGGER.info("Updating Mercedes me component.")
-        hass.data[DOMAIN].data.update()
-        dispatcher_send(hass, SIGNAL_UPDATE_MERCEDESME)
+        if mercedesme_api.is_async:
+            await mercedesme_api.async_update()
+        else:
+            await hass.async_add_executor_job(mercedesme_api.update)
+
+    async_track_time_interval(hass, hub_refresh, timedelta(seconds=scan_interval))
 
-    track_time_interval(hass, hub_refresh, timedelta(seconds=scan_interval))
+    async def hub_discover(event_time):
+        """Look for cars added to or removed from the account."""
+        if mercedesme_api.is_async:
+            await mercedesme_api.async_discover()
+        else:
+            await hass.async_add_executor_job(mercedesme_api.discover)
+
+    discovery_interval = conf.get(CONF_DISCOVERY_INTERVAL)
+    if discovery_interval:
+        async_track_time_interval(
+            hass, hub_discover, timedelta(seconds=discovery_interval))
+
+    async def async_batch_command(call):
+        """Send a command to the selected cars."""
+        command = call.data[ATTR_COMMAND]
+        cars = call.data[ATTR_CARS]
+        if mercedesme_api.is_async:
+            results = await mercedesme_api.async_batch_command(command, cars)
+        else:
+            results = await hass.async_add_executor_job(
+                mercedesme_api.batch_command, command, cars)
+
+        _LOGGER.info("%s results: %s", command, results)
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_BATCH_COMMAND, async_batch_command,
+        schema=BATCH_COMMAND_SCHEMA)
 
     return True
 
@@ -179,8 +382,30 @@ class MercedesMeEntity(Entity):
         self._extended_attributes = extended_attributes
         self._kwargs = kwargs
         self._unique_id = slugify(f"{self._vin}_{self._internal_name}")
-        self._car = next(car for car in self._data.cars
-                         if car.finorvin == self._vin)
+        self._car = self._data.get_car(self._vin)
+
+        # (feature, object, attribute): compiled getter of the car value
+        self._accessors = {}
+        for name in [object_name] + list(extended_attributes or ()):
+            self._get_accessor(feature_name, name, "retrievalstatus")
+            self._get_accessor(feature_name, name, "value")
+        self._get_accessor(feature_name, object_name, attrib_name)
+
+        # target state of a command until the car confirms it
+        self._optimistic_state = None
+        self._optimistic_since = None
+        self._optimistic_timeout = None
+
+        # (car, snapshot version) of the state and the rendered values
+        self._snapshot = None
+        self._rendered = {}
+
+        # attributes of the car that show up in the state of the entity
+        self._watched_attributes = set(extended_attributes or ())
+        if object_name:
+            self._watched_attributes.add(object_name)
+        else:
+            self._watched_attributes.add(attrib_name)
 
         conf = hass.data[DOMAIN].config
         if conf.get(CONF_CARS) is not None:
@@ -200,6 +425,166 @@ class MercedesMeEntity(Entity):
         """Return the name of the sensor."""
         return self._unique_id
 
+    @property
+    def should_poll(self):
+        """Return False, the entity is updated by the signal of its car."""
+        return False
+
+    @property
+    def command_actions(self):
+        """Return the command actions whose status the entity shows."""
+        return ()
+
+    async def async_added_to_hass(self):
+        """Subscribe to the changes and commands of the car."""
+        self.async_on_remove(
+            async_dispatcher_connect(
+                self.hass,
+                SIGNAL_UPDATE_CAR.format(self._vin),
+                self._async_car_changed,
+            )
+        )
+        self.async_on_remove(
+            async_dispatcher_connect(
+                self.hass,
+                SIGNAL_REMOVE_CAR.format(self._vin),
+                self._async_car_removed,
+            )
+        )
+        if self.command_actions:
+            self.async_on_remove(self._async_clear_optimistic_state)
+            self.async_on_remove(
+                async_dispatcher_connect(
+                    self.hass,
+                    SIGNAL_COMMAND_CAR.format(self._vin),
+                    self._async_command_changed,
+                )
+            )
+
+    @property
+    def assumed_state(self):
+        """Return True while the state is the unconfirmed command target."""
+        return self._optimistic_state is not None
+
+    def _get_device_state(self):
+        """Return the state of the entity out of the car state."""
+        return self._state
+
+    async def _async_send_command(self, state, send, *args):
+        """Send a command and show its target state until the car confirms
+        it. A command that raised or failed right away rolls back."""
+        self._async_set_optimistic_state(state)
+        try:
+            result = await send(*args)
+        except Exception:
+            self._async_rollback_optimistic_state()
+            raise
+
+        if result is False:
+            self._async_rollback_optimistic_state()
+
+    @callback
+    def _async_set_optimistic_state(self, state):
+        """Show the target state of a command until the car confirms it.
+
+        The state expires when the command and the confirming car state
+        take longer than COMMAND_TIMEOUT + OPTIMISTIC_STATE_TIMEOUT seconds.
+        """
+        self._async_clear_optimistic_state()
+        self._optimistic_state = state
+        self._optimistic_since = time.time()
+        self._async_set_optimistic_timeout(
+            COMMAND_TIMEOUT + OPTIMISTIC_STATE_TIMEOUT)
+        self.async_write_ha_state()
+
+    @callback
+    def _async_set_optimistic_timeout(self, delay):
+        if self._optimistic_timeout is not None:
+            self._optimistic_timeout()
+        self._optimistic_timeout = async_call_later(
+            self.hass, delay, self._async_expire_optimistic_state)
+
+    @callback
+    def _async_rollback_optimistic_state(self):
+        if self._optimistic_state is None:
+            return
+
+        _LOGGER.debug("Rollback of %s", self._internal_name)
+        self._async_clear_optimistic_state()
+        self.async_write_ha_state()
+
+    @callback
+    def _async_clear_optimistic_state(self):
+        if self._optimistic_timeout is not None:
+            self._optimistic_timeout()
+            self._optimistic_timeout = None
+        self._optimistic_state = None
+
+    @callback
+    def _async_expire_optimistic_state(self, now):
+        self._optimistic_timeout = None
+        self._async_clear_optimistic_state()
+        self.async_write_ha_state()
+
+    async def _async_car_removed(self):
+        """Remove the entity of a car that left the account."""
+        entity_id = self.entity_id
+        registry_entry = self.registry_entry
+        await self.async_remove()
+
+        if registry_entry is not None:
+            registry = await self.hass.helpers.entity_registry.async_get_registry()
+            registry.async_remove(entity_id)
+
+    @callback
+    def _async_car_changed(self, changed):
+        """Write the new state if one of the watched attributes changed."""
+        if self._watched_attributes.isdisjoint(changed):
+            return
+
+        self.update()
+
+        # the car state replaces the optimistic state once it reached the
+        # target or was measured after the command finished
+        if self._optimistic_state is not None:
+            timestamp = self._get_car_value(
+                self._feature_name, self._object_name, "timestamp", None)
+            command = self._data.commands.get_last_command(
+                self._vin, self.command_actions)
+            if self._get_device_state() == self._optimistic_state or (
+                    timestamp is not None and command is not None
+                    and command.finished is not None
+                    and timestamp > command.finished):
+                self._async_clear_optimistic_state()
+
+        self.async_write_ha_state()
+
+    @callback
+    def _async_command_changed(self, command):
+        """Write the new command status of the entity.
+
+        Any failed command of the entity rolls back the optimistic state,
+        a command joined by a later tap included. After a successful
+        command the optimistic state is kept until the refreshed car state
+        arrives, at most OPTIMISTIC_STATE_TIMEOUT seconds.
+        """
+        if command.action not in self.command_actions:
+            return
+
+        if self._optimistic_state is not None:
+            if command.status == COMMAND_FAILED:
+                _LOGGER.debug("%s failed, rollback of %s", command.action,
+                              self._internal_name)
+                self._async_clear_optimistic_state()
+            elif command.status == COMMAND_SUCCESS:
+                if self._get_device_state() == self._optimistic_state:
+                    self._async_clear_optimistic_state()
+                else:
+                    self._async_set_optimistic_timeout(
+                        OPTIMISTIC_STATE_TIMEOUT)
+
+        self.async_write_ha_state()
+
     def device_retrieval_status(self):
         return self._get_car_value(
             self._feature_name, self._object_name, "retrievalstatus", "error"
@@ -209,45 +594,70 @@ class MercedesMeEntity(Entity):
         """Get the latest data and updates the states."""
         _LOGGER.debug("Updating %s", self._internal_name)
 
-        self._car = next(car for car in self._data.cars
-                         if car.finorvin == self._vin)
+        self._car = self._data.get_car(self._vin)
+
+        snapshot = (self._car, getattr(self._car, "version", None))
+        if snapshot == self._snapshot:
+            return
 
+        self._snapshot = snapshot
+        self._rendered = {}
         self._state = self._get_car_value(
             self._feature_name, self._object_name, self._attrib_name, "error"
         )
 
         _LOGGER.debug("Updated %s %s", self._internal_name, self._state)
 
-    def _get_car_value(self, feature, object_name, attrib_name, default_value):
-        value = None
-
-        if object_name:
-            if not feature:
-                value = getattr(
-                    getattr(self._car, object_name, default_value),
-                    attrib_name,
-                    default_value,
-                )
+    def _get_rendered(self, key, render):
+        """Get a value rendered out of the current snapshot of the car.
+
+        The value is rendered on first use and reused until update() reads a
+        new snapshot version.
+        """
+        try:
+            return self._rendered[key]
+        except KeyError:
+            value = self._rendered[key] = render()
+            return value
+
+    def _get_accessor(self, feature, object_name, attrib_name):
+        """Get the getter of a car value, compiled on first use."""
+        key = (feature, object_name, attrib_name)
+        accessor = self._accessors.get(key)
+        if accessor is None:
+            if not object_name:
+                path = [attrib_name]
+            elif not feature:
+                path = [object_name, attrib_name]
             else:
-                value = getattr(
-                    getattr(
-                        getattr(self._car, feature, default_value),
-                        object_name,
-                        default_value,
-                    ),
-                    attrib_name,
-                    default_value,
-                )
+                path = [feature, object_name, attrib_name]
 
-        else:
-            value = getattr(self._car, attrib_name, default_value)
+            accessor = attrgetter(".".join(path))
+            self._accessors[key] = accessor
 
-        return value
+        return accessor
+
+    def _get_car_value(self, feature, object_name, attrib_name, default_value):
+        try:
+            return self._get_accessor(
+                feature, object_name, attrib_name)(self._car)
+        except AttributeError:
+            return default_value
 
     @property
     def device_state_attributes(self):
         """Return the state attributes."""
+        state = self._get_rendered("attributes", self._render_state_attributes)
+
+        if self.command_actions:
+            command = self._data.commands.get_last_command(
+                self._vin, self.command_actions)
+            state = dict(state, command_status=None if command is None
+                         else command.status)
 
+        return state
+
+    def _render_state_attributes(self):
         state = {
             "car": self._licenseplate,
             "retrievalstatus": self._get_car_value(
@@ -275,8 +685,12 @@ class MercedesMeEntity(Entity):
     @property
     def unit_of_measurement(self):
         """Return the unit of measurement."""
-        if self._unit == LENGTH_KILOMETERS and \
-           not self._hass.config.units.is_metric:
+        is_metric = self._hass.config.units.is_metric
+        return self._get_rendered(("unit", is_metric),
+                                  lambda: self._render_unit(is_metric))
+
+    def _render_unit(self, is_metric):
+        if self._unit == LENGTH_KILOMETERS and not is_metric:
             return LENGTH_MILES
         else:
             return self._unit
@@ -9,11 +9,21 @@ Attributes:
 
 import json
 import logging
+import os
 import time
 import datetime
 
-from multiprocessing import RLock
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import threading
+
+from .commands import COMMAND_SUCCESS, CommandPoller, CommandTracker
+from .lanes import (LANE_BACKGROUND, LANE_COMMAND, LANE_TARGETED,
+                    LaneExecutor)
+from .oauth import TokenManager
+from .scheduler import PollScheduler
+from .singleflight import SingleFlight
+from .store import FleetStore
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -21,7 +31,8 @@ URL_VHS_API = lambda region: f"https://vhs.meapp{region}.secure.mercedes-benz.co
 URL_USR_API = lambda region: f"https://bff.meapp{region}.secure.mercedes-benz.com"                  # noqa: E731, E501
 
 ME_STATUS_URL = lambda usr_url: f"{usr_url}/api/v2/appdata"                                         # noqa: E731, E501
-CAR_STATUS_URL = lambda vhs_url: f"{vhs_url}/%s/dynamic?forceRefresh=true"                          # noqa: E731, E501
+CAR_STATUS_URL = lambda vhs_url: f"{vhs_url}/%s/dynamic"                                            # noqa: E731, E501
+CAR_STATUS_FORCE_URL = lambda vhs_url: f"{vhs_url}/%s/dynamic?forceRefresh=true"                    # noqa: E731, E501
 CAR_LOCAT_URL = lambda vhs_url: f"{vhs_url}/%s/location"                                            # noqa: E731, E501
 CAR_LOCK_URL = lambda vhs_url: f"{vhs_url}/%s/doors/lock"                                           # noqa: E731, E501
 CAR_UNLOCK_URL = lambda vhs_url: f"{vhs_url}/%s/doors/unlock"                                       # noqa: E731, E501
@@ -34,6 +45,19 @@ CAR_CLIMATE_ON_URL = lambda vhs_url: f"{vhs_url}/%s/precond/start"
 CAR_CLIMATE_OFF_URL = lambda vhs_url: f"{vhs_url}/%s/precondAtDeparture/disable"                    # noqa: E731, E501
 CAR_FEATURE_URL = lambda usr_url: f"{usr_url}/api/v2/dashboarddata/%s/vehicle"                      # noqa: E731, E501
 
+# action: (url, pin required, categories changed by the action)
+CAR_ACTIONS = {
+    "lock": (CAR_LOCK_URL, False, ["doors"]),
+    "unlock": (CAR_UNLOCK_URL, True, ["doors"]),
+    "heater_on": (CAR_HEAT_ON_URL, False, ["auxheat"]),
+    "heater_off": (CAR_HEAT_OFF_URL, False, ["auxheat"]),
+    "climate_on": (CAR_CLIMATE_ON_URL, False, ["precond"]),
+    "climate_conf": (CAR_CLIMATE_CONF_URL, False, ["precond"]),
+    "climate_off": (CAR_CLIMATE_OFF_URL, False, ["precond"]),
+    "remote_start_on": (CAR_REMOTE_START_ON_URL, True, ["remote_start"]),
+    "remote_start_off": (CAR_REMOTE_START_OFF_URL, False, ["remote_start"]),
+}
+
 APP_USER_AGENT = "MercedesMe/2.15.1+753 (Android 6.0)"
 
 HTTP_GET = "get"
@@ -44,6 +68,22 @@ HTTP_POST = "post"
 # Change to True for production
 LOGIN_VERIFY_SSL_CERT = True
 
+# seconds between two forceRefresh calls, they wake up the car
+DEFAULT_FORCE_REFRESH_INTERVAL = 3600
+# seconds a cached state (vtime) may be older than the last forceRefresh
+# before the car is woken up again, a wake up that brought no fresh state
+# is retried after that time
+DEFAULT_STALE_THRESHOLD = 900
+
+# seconds until the feature enablements of a car are fetched again
+DEFAULT_FEATURE_TTL = 86400
+# seconds between two looks for cars added to or removed from the account
+DEFAULT_DISCOVERY_INTERVAL = 3600
+
+# cars, features and last state of the fleet in the save_path, see
+# BaseController._save_snapshot
+SNAPSHOT_FILE = ".mercedesme-snapshot.json"
+SNAPSHOT_VERSION = 1
 
 ODOMETER_OPTIONS = [
     "odo",
@@ -86,7 +126,7 @@ TIRE_OPTIONS = [
     "tirepressureFrontLeft",
     "tirewarninglamp",
     "tirewarningsrdk",
-    "tirewarningsprw"
+    "tirewarningsprw",
     "tireMarkerFrontRight",
     "tireMarkerFrontLeft",
     "tireMarkerRearLeft",
@@ -204,6 +244,10 @@ class Car(object):
         self.numberofdoors = None
         self.numberofseats = None
         self.vehicle_title = None
+        # row of the car in the FleetStore
+        self.slot = None
+        # snapshot version, incremented by every refresh that changed the car
+        self.version = 0
 
         self.vehicleHealthStatus = None
         self.binarysensors = None
@@ -217,6 +261,7 @@ class Car(object):
         self.auxheat = None
         self.precond = None
         self.electric = None
+        self.remote_start = None
         self.car_alarm = None
 
 
@@ -238,94 +283,144 @@ class StateOfObject(object):
             self.timestamp = timestamp
 
 
-class Tires(object):
-    def __init__(self):
-        self.name = "Tires"
-
-
-class Odometer(object):
-    def __init__(self):
-        self.name = "Odometer"
-
-
 class Features(object):
     def __init__(self):
         self.name = "Features"
 
 
-class Windows(object):
-    def __init__(self):
-        self.name = "Windows"
-
+# Registry of the dynamic payload
+# car attribute: (name, options, required feature)
+DYNAMIC_CATEGORIES = {
+    "odometer": ("Odometer", ODOMETER_OPTIONS, None),
+    "tires": ("Tires", TIRE_OPTIONS, None),
+    "doors": ("Doors", DOOR_OPTIONS, None),
+    "binarysensors": ("Binary_Sensors", BINARY_SENSOR_OPTIONS, None),
+    "windows": ("Windows", WINDOW_OPTIONS, None),
+    "electric": ("Electric", ELECTRIC_OPTIONS, "charging_clima_control"),
+    "auxheat": ("Auxheat", AUX_HEAT_OPTIONS, "aux_heat"),
+    "precond": ("Precond", PRE_COND_OPTIONS, "charging_clima_control"),
+    "remote_start": ("Remote_Start", REMOTE_START_OPTIONS, "remote_engine_start"),
+    "car_alarm": ("Car_Alarm", CAR_ALARM_OPTIONS, "car_alarm"),
+}
 
-class Doors(object):
-    def __init__(self):
-        self.name = "Doors"
+# served by CAR_LOCAT_URL instead of CAR_STATUS_URL
+LOCATION_CATEGORY = "location"
+LOCATION_FEATURE = "vehicle_locator"
 
+CATEGORIES = list(DYNAMIC_CATEGORIES) + [LOCATION_CATEGORY]
 
-class Electric(object):
-    def __init__(self):
-        self.name = "Electric"
+# min seconds between two refreshes of a category, 0 refreshes on every poll
+DEFAULT_CATEGORY_TTL = {category: 0 for category in CATEGORIES}
+DEFAULT_CATEGORY_TTL["tires"] = 3600
 
+# category: (name, options) of the FleetStore
+STORE_CATEGORIES = {category: value[:2]
+                    for category, value in DYNAMIC_CATEGORIES.items()}
+STORE_CATEGORIES[LOCATION_CATEGORY] = ("Location", LOCATION_OPTIONS)
 
-class Auxheat(object):
-    def __init__(self):
-        self.name = "Auxheat"
 
+def get_category_updates(store, slot, car_detail, categories):
+    """ diff the dynamic payload against the store row of a car in one pass.
 
-class Precond(object):
-    def __init__(self):
-        self.name = "Precond"
-
-
-class Binary_Sensors(object):
-    def __init__(self):
-        self.name = "Binary_Sensors"
-
+    Attributes shared by several categories are diffed once. Returns the
+    store updates of the attributes whose value, retrieval status or
+    timestamp changed.
+    """
+    columns = store.get_columns(categories)
+    updates = {}
+
+    if car_detail is None:
+        for column in columns.values():
+            update = store.get_update(slot, column, -1, -1, None)
+            if update is not None:
+                updates[column] = update
+        return updates
+
+    values, statuses, timestamps = store.rows[slot]
+    get_status_code = store.get_status_code
+    vtime = store.get_timestamp_value(car_detail.get("vtime"))
+    missing_status = get_status_code(4)
+
+    for option, column in columns.items():
+        curr = car_detail.get(option)
+        if curr is not None:
+            value = curr.get("value")
+            status = get_status_code(curr.get("status"))
+            timestamp = vtime
+        else:
+            value = 0
+            status = missing_status
+            timestamp = 0
 
-class Remote_Start(object):
-    def __init__(self):
-        self.name = "Remote_Start"
+        if values[column] != value or statuses[column] != status or \
+           timestamps[column] != timestamp:
+            updates[column] = (value, status, timestamp)
 
+    return updates
 
-class Car_Alarm(object):
-    def __init__(self):
-        self.name = "Car_Alarm"
 
+def get_location_updates(store, slot, api_result):
+    """ diff the location payload against the store row of a car."""
+    updates = {}
+    for option, column in store.categories[LOCATION_CATEGORY][1].items():
+        if api_result is not None:
+            update = store.get_update(
+                slot, column, api_result.get(option), None, None)
+        else:
+            update = store.get_update(slot, column, -1, -1, None)
 
-class Location(object):
-    def __init__(self, latitude=None, longitude=None, heading=None):
-        self.name = "Location"
-        self.latitude = None
-        self.longitude = None
-        self.heading = None
-        if latitude is not None:
-            self.latitude = latitude
-        if longitude is not None:
-            self.longitude = longitude
-        if heading is not None:
-            self.heading = heading
+        if update is not None:
+            updates[column] = update
 
+    return updates
 
-class CarAttribute(object):
-    def __init__(self, value, retrievalstatus, timestamp):
-        self.value = value
-        self.retrievalstatus = retrievalstatus
-        self.timestamp = timestamp
 
+def set_category_values(store, slot, car_detail, categories):
+    """ parse the dynamic payload into the store row of a car.
 
-class Controller(object):
-    """ Simple Mercedes me API.
+    Returns the names of the changed attributes.
     """
+    return store.update_row(
+        slot, get_category_updates(store, slot, car_detail, categories))
+
+
+class BaseController(object):
+    """ Shared state and payload handling of the Mercedes me API controllers.
+
+    The base class does not do any I/O. Controller and AsyncController add
+    the blocking and the asyncio transport on top of it.
+
+    Attributes:
+        max_workers (int): number of cars refreshed in parallel
+        idle_update_interval (int): max update intervall in seconds of a
+            parked car, defaults to update_interval
+        category_ttl (dict): min seconds between two refreshes per category,
+            see DEFAULT_CATEGORY_TTL
+        force_refresh_interval (int): min seconds between two polls that
+            wake up the car with forceRefresh
+        stale_threshold (int): seconds the cached state (vtime) may be
+            older than the last forceRefresh, else the car is woken up
+            again stale_threshold seconds after the last forceRefresh
+        warm_start (bool): start with the cars of the snapshot of the last
+            run, the API is asked by revalidate afterwards
+        feature_ttl (int): seconds until the feature enablements of a car
+            are fetched again by a refresh
+    """
+    is_async = False
+
     def __init__(self, auth_handler, update_interval, accept_lang,
                  country_code, excluded_cars, save_car_details,
-                 pin, save_path):
+                 pin, save_path, max_workers=1, idle_update_interval=None,
+                 category_ttl=None,
+                 force_refresh_interval=DEFAULT_FORCE_REFRESH_INTERVAL,
+                 stale_threshold=DEFAULT_STALE_THRESHOLD, warm_start=False,
+                 feature_ttl=DEFAULT_FEATURE_TTL):
 
-        self.__lock = RLock()
         self.accept_lang = accept_lang
         self.country_code = country_code
         self.auth_handler = auth_handler
         self.cars = []
+        self.cars_by_vin = {}
         self.update_interval = update_interval
         self.excluded_cars = excluded_cars
         self.is_valid_session = False
@@ -333,45 +428,705 @@ class Controller(object):
         self.save_car_details = save_car_details
         self.save_path = save_path
         self.pin = pin
+        self.max_workers = max_workers
         self.region = "-an" if country_code == "US" else ""
+        self.scheduler = PollScheduler(
+            update_interval, idle_update_interval or update_interval)
+        self.category_ttl = dict(DEFAULT_CATEGORY_TTL)
+        self.category_ttl.update(category_ttl or {})
+        self._category_update_time = {}
+        self.force_refresh_interval = force_refresh_interval
+        self.stale_threshold = stale_threshold
+        self._forced_refresh_time = {}
+        self._forced_refresh_pending = set()
+        self._car_vtime = {}
+        self._car_fingerprint = {}
+        self.store = FleetStore(STORE_CATEGORIES)
+        self._update_listeners = []
+        self.commands = CommandTracker()
+        self.warm_start = warm_start
+        self.feature_ttl = feature_ttl
+        # fin: time of the last feature fetch
+        self._feature_time = {}
+        self._feature_listeners = []
+        self._car_listeners = []
+        # True while the cars are the ones of the snapshot
+        self.is_warm = False
+        self._snapshot_lock = threading.Lock()
+
+    def get_car(self, car_id):
+        """ get the car of a fin or vin, None for an unknown car."""
+        return self.cars_by_vin.get(car_id)
+
+    def add_update_listener(self, listener):
+        """ call listener(changed_cars) after every refresh that changed
+        a car, changed_cars is {fin: change set}.
+
+        The Controller calls the listener in its worker thread, the
+        AsyncController in the event loop.
+        """
+        self._update_listeners.append(listener)
+
+    def add_feature_listener(self, listener):
+        """ call listener(new_features) after a refresh activated features
+        of a known car, new_features is {fin: feature names}.
+
+        The state of the new features is refreshed before, see
+        add_update_listener for the calling thread.
+        """
+        self._feature_listeners.append(listener)
+
+    def add_car_listener(self, listener):
+        """ call listener(added, removed) after cars were added to or
+        removed from the account, added and removed are lists of fins.
+
+        Added cars have their features and state already, see
+        add_update_listener for the calling thread.
+        """
+        self._car_listeners.append(listener)
+
+    def _notify_car_listeners(self, added, removed):
+        if not added and not removed:
+            return
+
+        for listener in self._car_listeners:
+            try:
+                listener(added, removed)
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Error in car listener %s", listener)
+
+    def _notify_feature_listeners(self, new_features):
+        if not new_features:
+            return
+
+        for listener in self._feature_listeners:
+            try:
+                listener(new_features)
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Error in feature listener %s", listener)
+
+    def _notify_update_listeners(self, changed_cars):
+        if not changed_cars:
+            return
+
+        for listener in self._update_listeners:
+            try:
+                listener(changed_cars)
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Error in update listener %s", listener)
+
+    def _get_due_cars(self, now):
+        """ get the cars whose poll interval is over."""
+        return [car for car in self.cars
+                if self.scheduler.is_due(car.finorvin, now)]
+
+    def _get_feature_due_cars(self, now):
+        """ get the cars whose features are missing or older than
+        feature_ttl."""
+        return [car for car in self.cars
+                if car.features is None or
+                now - self._feature_time.get(car.finorvin, 0) >=
+                self.feature_ttl]
+
+    def _get_enabled_categories(self, car, categories=CATEGORIES):
+        """ get the categories whose feature is activated for a car."""
+        enabled = set()
+        for category in categories:
+            if category == LOCATION_CATEGORY:
+                feature = LOCATION_FEATURE
+            else:
+                feature = DYNAMIC_CATEGORIES[category][2]
+
+            if feature is None or getattr(car.features, feature, False):
+                enabled.add(category)
+
+        return enabled
+
+    def _get_due_categories(self, car, now):
+        """ get the enabled categories of a car whose ttl is over."""
+        update_times = self._category_update_time.get(car.finorvin, {})
+        categories = set()
+
+        for category in self._get_enabled_categories(car):
+            # The refresh ticks are update_interval apart, round to the
+            # closest tick.
+            age = now - update_times.get(category, 0)
+            if age + self.update_interval / 2 >= self.category_ttl[category]:
+                categories.add(category)
+
+        return categories
+
+    def _use_forced_refresh(self, car, now):
+        """ check if the next poll of a car has to wake up the car.
+
+        Routine polls read the cached state of the backend. The car is
+        woken up after a command and every force_refresh_interval seconds.
+        A parked car does not update its cached state between two wake ups,
+        so the staleness of the state is measured against the last wake up:
+        if the state is older than the last wake up by more than
+        stale_threshold seconds, the wake up did not get through and is
+        retried stale_threshold seconds later.
+        """
+        if car.finorvin in self._forced_refresh_pending:
+            return True
+
+        last_forced = self._forced_refresh_time.setdefault(car.finorvin, now)
+        if now - last_forced >= self.force_refresh_interval:
+            return True
+
+        vtime = self._car_vtime.get(car.finorvin)
+        if vtime and last_forced - vtime > self.stale_threshold and \
+           now - last_forced > self.stale_threshold:
+            return True
+
+        return False
+
+    def _set_forced_refresh_done(self, car_id):
+        self._forced_refresh_time[car_id] = time.time()
+        self._forced_refresh_pending.discard(car_id)
+
+    def _set_command_done(self, car_id):
+        """ refresh the car woken up with the next poll after a command."""
+        self._forced_refresh_pending.add(car_id)
+        self.scheduler.mark_active(car_id)
+
+    def _get_command_categories(self, command):
+        """ get the enabled categories of a car changed by a command."""
+        car = self.get_car(command.car_id)
+        if car is None:
+            return set()
+        return self._get_enabled_categories(car, CAR_ACTIONS[command.action][2])
+
+    def _is_command_pending(self, car_id, action):
+        """ check if the same command is still pending for a car."""
+        command = self.commands.get_command(car_id, action)
+        if command is None or command.is_done:
+            return False
+
+        # a command whose polling got lost must not block the car forever
+        if time.time() - command.started >= self.commands.timeout:
+            _LOGGER.warning("%s for %s is pending for too long, send again",
+                            action, car_id)
+            return False
+
+        _LOGGER.debug("%s for %s is already pending", action, car_id)
+        return True
+
+    def _get_command_succeeded(self, command):
+        """ check the result of a done command."""
+        if command.status != COMMAND_SUCCESS:
+            _LOGGER.error("Failed to execute action %s for car %s.",
+                          command.action, command.car_id)
+            return False
+
+        self._set_command_done(command.car_id)
+        return True
+
+    def _get_car_action(self, action, car_id):
+        """ get the arguments of _execute_car_action for an action."""
+        url, needs_pin, _ = CAR_ACTIONS[action]
+
+        post_data = None
+        if action == "heater_on":
+            now = datetime.datetime.now()
+            post_data = json.dumps(
+                {"currentDepartureTime": (now.hour * 60 + now.minute)})
+        elif action == "climate_on":
+            now = self._round_current_time()
+            post_data = json.dumps(
+                {"currentDepartureTime": (now.hour * 60 + now.minute)},
+                separators=(',', ':'))
+        elif action == "climate_conf":
+            now = self._round_current_time()
+            post_data = json.dumps(
+                {"departureTime": f"{now.hour:02}:{now.minute:02}",
+                 "mode": "SINGLE_DEPARTURE"},
+                separators=(',', ':'))
+
+        if post_data is not None:
+            _LOGGER.debug("%s post_data: %s", action, post_data)
+
+        return (url(URL_VHS_API(self.region)), car_id, action,
+                self.pin if needs_pin else None, post_data)
+
+    def _get_action_header(self, pin, post_data):
+        header = self._get_default_header()
+        if pin is not None:
+            header['x-pin'] = pin
+
+        if post_data is not None:
+            header['Content-Type'] = "application/json;charset=UTF-8"
+            header['Content-Length'] = str(len(post_data))
+
+        return header
+
+    def _new_car(self, vehicle):
+        """ create a Car out of an entry of the appdata vehicle list."""
+        if vehicle.get("fin") is None or \
+           vehicle.get("fin") in self.excluded_cars:
+            return None
+
+        car = Car()
+        car.finorvin = vehicle.get("fin")
+
+        car.licenseplate = vehicle.get("licensePlate", "")
+
+        if not car.licenseplate:
+            car.licenseplate = car.finorvin
+
+        car.vehicle_title = vehicle.get("vehicleTitle", None)
+        car.slot = self.store.add_car(car.finorvin)
+
+        # car.salesdesignation = detail.get("salesDesignation")
+
+        return car
+
+    def _get_selected_car_ids(self, selector):
+        """ get the fins of the selected cars.
+
+        selector is a fin or vin, "all", a feature name for all cars with
+        the activated feature, or a list of them.
+        """
+        if isinstance(selector, str):
+            selector = [selector]
+
+        car_ids = []
+        for car in self.cars:
+            for item in selector:
+                if item == "all" or item == car.finorvin or \
+                   getattr(car.features, item, False) is True:
+                    car_ids.append(car.finorvin)
+                    break
+
+        return car_ids
+
+    def _add_car(self, car):
+        self.cars.append(car)
+        self.cars_by_vin[car.finorvin] = car
+
+    def _set_vehicles(self, vehicles):
+        """ diff the vehicle list of the account against the known cars.
+
+        New cars are added without features and state, missing and
+        excluded cars are removed. An empty list removes no car, a broken
+        answer must not retire the whole fleet. Returns the new cars and
+        the fins of the removed cars.
+        """
+        added = []
+        for vehicle in vehicles:
+            if self.get_car(vehicle.get("fin")) is None:
+                car = self._new_car(vehicle)
+                if car is not None:
+                    self._add_car(car)
+                    added.append(car)
+
+        if not vehicles:
+            if self.cars:
+                _LOGGER.warning("No cars in the account, keeping the known cars")
+            return added, []
+
+        fins = {vehicle.get("fin") for vehicle in vehicles}
+        removed = [car for car in self.cars
+                   if car.finorvin not in fins or
+                   car.finorvin in self.excluded_cars]
+        for car in removed:
+            _LOGGER.info("Car %s removed from the account", car.finorvin)
+            self._remove_car(car)
+
+        return added, [car.finorvin for car in removed]
+
+    def _remove_car(self, car):
+        """ forget a car, its categories are detached so entities left
+        over read their default values."""
+        for category in CATEGORIES:
+            setattr(car, category, None)
+        car.version += 1
+
+        self.cars_by_vin.pop(car.finorvin, None)
+        if car in self.cars:
+            self.cars.remove(car)
+        self.store.remove_car(car.finorvin)
+        self.scheduler.forget(car.finorvin)
+        for state in [self._category_update_time, self._forced_refresh_time,
+                      self._car_vtime, self._feature_time]:
+            state.pop(car.finorvin, None)
+        self._forced_refresh_pending.discard(car.finorvin)
+        for source in ["dynamic", LOCATION_CATEGORY]:
+            self._car_fingerprint.pop((car.finorvin, source), None)
+
+    def _set_car_state(self, car, api_result, location_result, categories):
+        """ merge the fetched dynamic state and location into the car.
+
+        The new state of the car is published as a whole, see FleetStore.
+        The caller serializes the writers of a car. Categories that were
+        already parsed out of a payload with the same vtime and content are
+        skipped. Returns the change set of the car, the names of the
+        attributes whose value, retrieval status or timestamp changed.
+        """
+        # the car was removed while its state was fetched
+        if self.get_car(car.finorvin) is not car:
+            return set()
+
+        api_result = api_result.get("dynamic") if api_result else None
+        update_times = self._category_update_time.setdefault(car.finorvin, {})
+        now = time.time()
+
+        if api_result is not None and api_result.get("vtime"):
+            self._car_vtime[car.finorvin] = api_result.get("vtime")
+
+        categories = set(categories)
+        unchanged = set()
+        # a missing payload writes the error state, the next payload must be
+        # parsed again even if it equals the last one
+        if api_result is not None:
+            unchanged.update(self._get_unchanged_categories(
+                car.finorvin, "dynamic", api_result.get("vtime"), api_result,
+                categories.difference([LOCATION_CATEGORY])))
+        elif categories.difference([LOCATION_CATEGORY]):
+            self._car_fingerprint.pop((car.finorvin, "dynamic"), None)
+        if LOCATION_CATEGORY in categories:
+            if location_result is not None:
+                unchanged.update(self._get_unchanged_categories(
+                    car.finorvin, LOCATION_CATEGORY, None, location_result,
+                    {LOCATION_CATEGORY}))
+            else:
+                self._car_fingerprint.pop(
+                    (car.finorvin, LOCATION_CATEGORY), None)
+
+        for category in categories:
+            if category == LOCATION_CATEGORY:
+                received = location_result is not None
+            else:
+                received = api_result is not None
+
+            # failed categories are retried on the next poll
+            if received:
+                update_times[category] = now
+
+        parsed = categories.difference(unchanged)
+
+        updates = {}
+        if LOCATION_CATEGORY in parsed:
+            _LOGGER.debug("get_location result: %s", location_result)
+            updates.update(get_location_updates(
+                self.store, car.slot, location_result))
+
+        _LOGGER.debug("get_category_updates %s for %s called",
+                      sorted(parsed), car.finorvin)
+        updates.update(get_category_updates(
+            self.store, car.slot, api_result,
+            parsed.difference([LOCATION_CATEGORY])))
+
+        # one new row per refresh, readers see the whole refresh or nothing
+        changed = self.store.update_row(car.slot, updates)
+
+        # a view reads the row it was created on, the new row gets new views
+        for category in CATEGORIES:
+            if getattr(car, category, None) is None:
+                if category in parsed:
+                    setattr(car, category,
+                            self.store.get_category(car.slot, category))
+            elif changed:
+                setattr(car, category,
+                        self.store.get_category(car.slot, category))
+
+        if changed:
+            car.version += 1
+
+        if unchanged:
+            _LOGGER.debug("%s unchanged for %s", sorted(unchanged), car.finorvin)
+        _LOGGER.debug("%s attributes changed for %s", len(changed), car.finorvin)
+
+        return changed
+
+    def _get_unchanged_categories(self, car_id, source, vtime, result,
+                                  categories):
+        """ get the categories already parsed out of an identical payload."""
+        fingerprint = hash(json.dumps(result, sort_keys=True))
+
+        last = self._car_fingerprint.get((car_id, source))
+        if last is None or last[0] != vtime or last[1] != fingerprint:
+            last = (vtime, fingerprint, set())
+            self._car_fingerprint[(car_id, source)] = last
+
+        unchanged = categories.intersection(last[2])
+        last[2].update(categories)
+        return unchanged
+
+    def _set_car_features(self, car, features):
+        """ set the features of a car out of the dashboard data.
+
+        A failed request keeps the former features. Returns the names of
+        the features that got activated, empty for a car without features.
+        """
+        if features is None:
+            _LOGGER.error("Failed to get the features of car %s",
+                          car.finorvin)
+            return set()
+
+        former = car.features
+        car.features = self._get_car_features(car.finorvin, features)
+        self._feature_time[car.finorvin] = time.time()
+        if former is None:
+            return set()
+
+        return {name for name, enabled in vars(car.features).items()
+                if enabled is True and getattr(former, name, None) is not True}
+
+    def _get_car_features(self, car_id, features):
+        """ get the feature enablements out of the dashboard data."""
+        car_features = Features()
+
+        for feature in features.get("metadata").get("featureEnablements"):
+            setattr(car_features,
+                    feature.get("name").lower(),
+                    feature.get("enablement") == "ACTIVATED")
+
+        return car_features
+
+    def _load_snapshot(self):
+        """ create the cars out of the snapshot of the last run.
+
+        Returns False if there is no usable snapshot, a broken snapshot
+        leaves no cars behind and the controller starts cold.
+        """
+        file_name = f"{self.save_path}{SNAPSHOT_FILE}"
+        try:
+            with open(file_name) as snapshot_file:
+                snapshot = json.load(snapshot_file)
+        except (IOError, ValueError):
+            return False
+
+        if not isinstance(snapshot, dict) or \
+           snapshot.get("version") != SNAPSHOT_VERSION:
+            _LOGGER.info("Skip snapshot %s of an unknown version", file_name)
+            return False
+
+        try:
+            for entry in snapshot["cars"]:
+                self._load_snapshot_car(entry)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            _LOGGER.warning("Skip the broken snapshot %s", file_name)
+            for car in list(self.cars):
+                self._remove_car(car)
+            return False
+
+        _LOGGER.debug("%s cars loaded from the snapshot", len(self.cars))
+        self.is_warm = True
+        return True
+
+    def _load_snapshot_car(self, entry):
+        car = self._new_car(entry["vehicle"])
+        if car is None:
+            return
+
+        # the car is known to the controller before its state is read, a
+        # broken entry is removed with the other cars of the snapshot
+        self._add_car(car)
+        car.features = Features()
+        for name, enabled in entry["features"].items():
+            setattr(car.features, name, enabled)
+        self._feature_time[car.finorvin] = entry.get("features_time", 0)
+        self.store.load_row(car.slot, entry["state"])
+        for category in entry["categories"]:
+            setattr(car, category,
+                    self.store.get_category(car.slot, category))
+
+    def _save_snapshot(self):
+        """ save the cars, their features and their last state.
+
+        Only saved with warm_start. The snapshot is written to a temporary
+        file first and then moved over the old one, a crash never leaves a
+        half written snapshot.
+        """
+        if not self.warm_start:
+            return
+
+        file_name = f"{self.save_path}{SNAPSHOT_FILE}"
+        with self._snapshot_lock:
+            try:
+                cars = []
+                for car in list(self.cars):
+                    features = dict(vars(car.features)) if car.features else {}
+                    features.pop("name", None)
+                    cars.append({
+                        "vehicle": {"fin": car.finorvin,
+                                    "licensePlate": car.licenseplate,
+                                    "vehicleTitle": car.vehicle_title},
+                        "features": features,
+                        "features_time": self._feature_time.get(
+                            car.finorvin, 0),
+                        "categories": [
+                            category for category in CATEGORIES
+                            if getattr(car, category, None) is not None],
+                        "state": self.store.dump_row(car.slot),
+                    })
+
+                with open(f"{file_name}.tmp", "w") as snapshot_file:
+                    json.dump({"version": SNAPSHOT_VERSION, "cars": cars},
+                              snapshot_file, separators=(",", ":"))
+                os.replace(f"{file_name}.tmp", file_name)
+            except (IOError, TypeError, ValueError):
+                _LOGGER.warning("Couldn't write the snapshot to %s", file_name)
+
+    def _save_car_details(self, file_name, data):
+        with open(f"{self.save_path}{file_name}", "w") as outfile:
+            json.dump(data, outfile)
+
+    def _get_bearer_token(self):
+        return "Bearer {}".format(self.auth_handler.token_info["access_token"])
+
+    def _get_default_header(self):
+        return {
+            "Accept-Language": self.accept_lang,
+            "Authorization": self._get_bearer_token(),
+            "country_code": self.country_code,
+            "User-Agent": APP_USER_AGENT,
+        }
+
+    def _round_current_time(self, roundTo=15):
+        t = datetime.datetime.now()  # type: datetime
+        t += datetime.timedelta(minutes=(roundTo + 1))
+        t += datetime.timedelta(minutes=(t.minute / roundTo) * roundTo - t.minute)
+        t -= datetime.timedelta(seconds=(t.second))
+        return t
+
+
+class Controller(BaseController):
+    """ Simple Mercedes me API.
+    """
+    def __init__(self, auth_handler, update_interval, accept_lang,
+                 country_code, excluded_cars, save_car_details,
+                 pin, save_path, max_workers=1, idle_update_interval=None,
+                 category_ttl=None,
+                 force_refresh_interval=DEFAULT_FORCE_REFRESH_INTERVAL,
+                 stale_threshold=DEFAULT_STALE_THRESHOLD, warm_start=False,
+                 feature_ttl=DEFAULT_FEATURE_TTL):
+
+        super().__init__(auth_handler, update_interval, accept_lang,
+                         country_code, excluded_cars, save_car_details,
+                         pin, save_path, max_workers, idle_update_interval,
+                         category_ttl, force_refresh_interval, stale_threshold,
+                         warm_start, feature_ttl)
+
+        # fin: lock of the writers of the car state
+        self._car_locks = {}
+        # commands first, then targeted refreshes, then background polling
+        self._lanes = LaneExecutor(self.max_workers)
+        self._command_poller = CommandPoller(self.commands)
+        self._single_flight = SingleFlight()
+        # an update and a discovery do not change the car list at once
+        self._fleet_lock = threading.Lock()
+        self._tokens = TokenManager(auth_handler)
+        self._tokens.start()
+
+        # imported here, the AsyncController does not need requests
+        import requests
 
         self.session = requests.session()
         # self.session.proxies.update(HTTP_PROXY)
+        # own connection pool, a command never waits for a free connection
+        # of the background polling
+        self.command_session = requests.session()
 
-        _LOGGER.debug("Controller init complete. Start _get_cars")
-        self._get_cars()
+        if warm_start and self._load_snapshot():
+            _LOGGER.debug("Controller init complete. Warm start")
+        else:
+            _LOGGER.debug("Controller init complete. Start _get_cars")
+            self._get_cars()
+
+    def stop(self):
+        """ stop the background token refresh."""
+        self._tokens.stop()
+
+    def revalidate(self):
+        """ get the cars, their features and state from the API after a
+        warm start.
+
+        Changed cars are passed to the update listeners. An update() called
+        meanwhile waits for the revalidation instead of polling again.
+        Returns the change sets of the changed cars.
+        """
+        _LOGGER.debug("Revalidate start")
+        return self._single_flight.do(
+            "update", self._run_locked, self._get_cars)
+
+    def discover(self):
+        """ look for cars added to or removed from the account.
+
+        Only the new cars are bootstrapped, in parallel. The car listeners
+        get the added and removed cars. A discovery called during an update
+        runs after it. Returns the change sets of the changed cars.
+        """
+        _LOGGER.debug("Discovery start")
+        return self._single_flight.do(
+            "discover", self._run_locked, self._get_cars, False)
 
     def update(self):
+        """ refresh the due cars.
+
+        Returns the change sets of the changed cars, {fin: attribute names}.
+        """
         _LOGGER.debug("Update start")
-        self._update_cars()
+        return self._single_flight.do(
+            "update", self._run_locked, self._update_cars)
+
+    def _run_locked(self, function, *args):
+        with self._fleet_lock:
+            return function(*args)
+
+    def _submit_refresh_car(self, car_id, categories):
+        """ queue a refresh of some categories of a car in the targeted lane
+        without waiting for it.
+
+        The car is woken up for a fresh state, the poll interval of the car
+        does not apply.
+        """
+        car = self.get_car(car_id)
+        if car is None or not categories:
+            return
+
+        _LOGGER.debug("submit refresh %s of %s", sorted(categories), car_id)
+        future = self._lanes.submit(
+            LANE_TARGETED, self._fetch_refreshed_car_state, car,
+            set(categories))
+        future.add_done_callback(partial(self._set_submitted_car_state, car))
+
+    def _fetch_refreshed_car_state(self, car, categories):
+        self._check_access_token()
+        return self._fetch_car_state(car, categories, True)
+
+    def _set_submitted_car_state(self, car, future):
+        # called by the lane worker that fetched the state
+        if future.exception() is not None:
+            _LOGGER.error("Failed to refresh %s: %s", car.finorvin,
+                          future.exception())
+            return
+        self._set_refreshed_car_state(car, future.result())
+
+    def _set_refreshed_car_state(self, car, car_state):
+        with self._get_car_lock(car.finorvin):
+            changed = self._set_car_state(car, *car_state)
+
+        if changed:
+            self._save_snapshot()
+            self._notify_update_listeners({car.finorvin: changed})
 
     def lock(self, car_id):
         return self._execute_car_action(
-            CAR_LOCK_URL(URL_VHS_API(self.region)),
-            car_id,
-            'car unlock',
-            None)
+            *self._get_car_action("lock", car_id))
 
     def unlock(self, car_id):
         return self._execute_car_action(
-            CAR_UNLOCK_URL(URL_VHS_API(self.region)),
-            car_id,
-            'car unlock',
-            self.pin)
+            *self._get_car_action("unlock", car_id))
 
     def remotestart_on(self, car_id):
         return self._execute_car_action(
-            CAR_REMOTE_START_ON_URL(URL_VHS_API(self.region)),
-            car_id.get('car_id'),
-            'car remote_start on',
-            self.pin)
+            *self._get_car_action("remote_start_on", car_id.get('car_id')))
 
     def remotestart_off(self, car_id):
         return self._execute_car_action(
-            CAR_REMOTE_START_OFF_URL(URL_VHS_API(self.region)),
-            car_id.get('car_id'),
-            'car remote_start off',
-            None)
+            *self._get_car_action("remote_start_off", car_id.get('car_id')))
 
     def switch_car_feature(self, action=None, car_id=None):
         function_list = {
@@ -388,150 +1143,266 @@ class Controller(object):
 
         return function_list[action](parameters)
 
-    def heater_on(self, car_id):
-        now = datetime.datetime.now()
+    def batch_lock(self, selector="all"):
+        return self.batch_command("lock", selector)
+
+    def batch_unlock(self, selector="all"):
+        return self.batch_command("unlock", selector)
+
+    def batch_switch_car_feature(self, action, selector="all"):
+        return self.batch_command(action, selector)
+
+    def batch_command(self, action, selector="all"):
+        """ send a command to several cars, see _get_selected_car_ids.
+
+        Up to max_workers commands are sent at the same time. Returns
+        {fin: result} of the selected cars.
+        """
+        if action == "lock":
+            function = self.lock
+        elif action == "unlock":
+            function = self.unlock
+        else:
+            function = partial(self.switch_car_feature, action)
+
+        def execute(car_id):
+            try:
+                return function(car_id)
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Failed to execute action %s for car %s.",
+                                  action, car_id)
+                return False
+
+        car_ids = self._get_selected_car_ids(selector)
+        _LOGGER.debug("%s for %s called", action, car_ids)
 
-        post_data = json.dumps(
-            {"currentDepartureTime": (now.hour * 60 + now.minute)})
+        with ThreadPoolExecutor(
+                max_workers=max(self.max_workers, 1),
+                thread_name_prefix="mercedesmeapi_batch") as executor:
+            return dict(zip(car_ids, executor.map(execute, car_ids)))
 
+    def heater_on(self, car_id):
         return self._execute_car_action(
-            CAR_HEAT_ON_URL(URL_VHS_API(self.region)),
-            car_id.get('car_id'),
-            'heater_on',
-            None,
-            post_data)
+            *self._get_car_action("heater_on", car_id.get('car_id')))
 
     def heater_off(self, car_id):
         return self._execute_car_action(
-            CAR_HEAT_OFF_URL(URL_VHS_API(self.region)),
-            car_id.get('car_id'),
-            'heater_off',
-            None)
+            *self._get_car_action("heater_off", car_id.get('car_id')))
 
     def climate_on(self, car_id):
-        now = self._round_current_time()
-        now_str = f"{now.hour:02}:{now.minute:02}"
-
-        post_data = json.dumps({"currentDepartureTime": (now.hour * 60 + now.minute)},
-                               separators=(',', ':'))
-        _LOGGER.debug("climate_on post_data:")
-        _LOGGER.debug(post_data)
-        if self._execute_car_action(CAR_CLIMATE_ON_URL(URL_VHS_API(self.region)),
-                                    car_id.get('car_id'), 'climate_on', None, post_data):
-            post_data2 = json.dumps({"departureTime": now_str, "mode": "SINGLE_DEPARTURE"},
-                                    separators=(',', ':'))
-            _LOGGER.debug("climate_conf post_data:")
-            _LOGGER.debug(post_data2)
-            self._execute_car_action(CAR_CLIMATE_CONF_URL(URL_VHS_API(self.region)),
-                                     car_id.get('car_id'), 'climate_conf', None, post_data2)
-        else:
-            _LOGGER.debug("climate_on FAILED")
-            return False
+        car_id = car_id.get('car_id')
+        return self._execute_car_action(
+            *self._get_car_action("climate_on", car_id),
+            on_success=partial(self._submit_car_action,
+                               *self._get_car_action("climate_conf", car_id)))
 
     def climate_off(self, car_id):
         return self._execute_car_action(
-            CAR_CLIMATE_OFF_URL(URL_VHS_API(self.region)),
-            car_id.get('car_id'),
-            'climate_off',
-            None)
-
-    def _execute_car_action(self, url, car_id, action, pin, post_data=None):
+            *self._get_car_action("climate_off", car_id.get('car_id')))
+
+    def _execute_car_action(self, url, car_id, action, pin, post_data=None,
+                            on_success=None):
+        """ send a command without waiting for its result.
+
+        The status of a pending command is polled in the background by the
+        command poller, see self.commands for the result. on_success is
+        called after the command succeeded. Returns False if the command
+        failed right away.
+
+        A command that is already being sent or pending for the car is not
+        sent again, the caller joins it.
+        """
+        return self._single_flight.do(
+            ("command", car_id, action), self._send_car_action,
+            url, car_id, action, pin, post_data, on_success)
+
+    def _submit_car_action(self, url, car_id, action, pin, post_data=None,
+                           on_success=None):
+        """ queue a command in the command lane without waiting for it, the
+        command poller chains commands this way."""
+        future = self._lanes.submit(
+            LANE_COMMAND, self._send_car_action, url, car_id, action, pin,
+            post_data, on_success, True)
+        future.add_done_callback(partial(self._log_car_action_error, action,
+                                         car_id))
+
+    def _log_car_action_error(self, action, car_id, future):
+        if future.exception() is not None:
+            _LOGGER.error("Failed to send %s for %s: %s", action, car_id,
+                          future.exception())
+
+    def _send_car_action(self, url, car_id, action, pin, post_data,
+                         on_success, in_lane=False):
         _LOGGER.debug("%s for %s called", action, car_id)
-        self._check_access_token()
-        header = self._get_default_header()
-        if pin is not None:
-            header['x-pin'] = pin
+        if self._is_command_pending(car_id, action):
+            return True
 
-        if post_data is not None:
-            header['Content-Type'] = "application/json;charset=UTF-8"
-            header['Content-Length'] = str(len(post_data))
+        self._check_access_token()
+        header = self._get_action_header(pin, post_data)
+        command = self.commands.start(car_id, action)
 
-        result = self._retrieve_json_at_url(
-            url % car_id, header, "post", post_data)
+        try:
+            # a call of the lane executor must not wait for another call
+            if in_lane:
+                result = self._retrieve_json_at_url(
+                    url % car_id, header, "post", post_data,
+                    self.command_session)
+            else:
+                result = self._lanes.run(
+                    LANE_COMMAND, self._retrieve_json_at_url, url % car_id,
+                    header, "post", post_data, self.command_session)
+        except Exception:
+            # a failed request fails the command, it must not stay pending
+            self.commands.set_result(command, None)
+            raise
 
         _LOGGER.debug(result)
 
-        if result is None:
-            _LOGGER.error("Failed to execute action %s for car %s.", action, car_id)
-            return False
-
-        if result.get("status") == 'PENDING':
-            wait_counter = 0
-            while wait_counter < 30:
-                result = self._retrieve_json_at_url(
-                    url % car_id, header, "get", None)
-                _LOGGER.debug(result)
+        if self.commands.set_result(command, result):
+            self._command_poller.submit(
+                command,
+                partial(self._lanes.run, LANE_COMMAND,
+                        self._retrieve_json_at_url, url % car_id, header,
+                        "get", None, self.command_session),
+                partial(self._set_command_result, on_success=on_success))
+            return True
 
-                if result.get('status') != 'FAILED' and result.get('status') != 'SUCCESS':
-                    wait_counter = wait_counter + 1
-                    time.sleep(3)
-                else:
-                    break
+        return self._set_command_result(command, on_success)
 
-        if result.get('status') == 'SUCCESS':
-            self.update()
-            return True
-        else:
+    def _set_command_result(self, command, on_success=None):
+        if not self._get_command_succeeded(command):
             return False
 
+        # a chained command goes first, on_success and the refresh only
+        # queue their requests, the command poller does not wait for them
+        if on_success is not None:
+            on_success()
+        self._submit_refresh_car(
+            command.car_id, self._get_command_categories(command))
+        return True
+
     def _update_cars(self):
         cur_time = time.time()
-        with self.__lock:
-            if self.auth_handler.is_token_expired(self.auth_handler.token_info):
-                self.auth_handler.refresh_access_token(
-                    self.auth_handler.token_info['refresh_token'])
-
-            if cur_time - self.last_update_time > self.update_interval:
-                for car in self.cars:
-
-                    api_result = self._retrieve_car_details(
-                        car.finorvin).get("dynamic")
-
-                    car.odometer = self._get_car_values(
-                        api_result, car.finorvin, Odometer(), ODOMETER_OPTIONS)
-                    car.tires = self._get_car_values(
-                        api_result, car.finorvin, Tires(), TIRE_OPTIONS)
-                    car.doors = self._get_car_values(
-                        api_result, car.finorvin, Doors(), DOOR_OPTIONS)
-
-                    if car.features.vehicle_locator:
-                        car.location = self._get_location(car.finorvin)
-
-                    car.binarysensors = self._get_car_values(
-                        api_result, car.finorvin,
-                        Binary_Sensors(), BINARY_SENSOR_OPTIONS)
-
-                    car.windows = self._get_car_values(
-                        api_result, car.finorvin, Windows(), WINDOW_OPTIONS)
-
-                    if car.features.charging_clima_control:
-                        car.electric = self._get_car_values(
-                            api_result, car.finorvin,
-                            Electric(), ELECTRIC_OPTIONS)
-
-                    if car.features.aux_heat:
-                        car.auxheat = self._get_car_values(
-                            api_result, car.finorvin,
-                            Auxheat(), AUX_HEAT_OPTIONS)
-
-                    if car.features.charging_clima_control:
-                        car.precond = self._get_car_values(
-                            api_result, car.finorvin,
-                            Precond(), PRE_COND_OPTIONS)
-
-                    if car.features.remote_engine_start:
-                        car.remote_start = self._get_car_values(
-                            api_result, car.finorvin,
-                            Remote_Start(), REMOTE_START_OPTIONS)
-
-                    if car.features.car_alarm:
-                        car.car_alarm = self._get_car_values(
-                            api_result, car.finorvin,
-                            Car_Alarm(), CAR_ALARM_OPTIONS)
+        changed_cars = {}
+        self._check_access_token()
 
-                self.last_update_time = time.time()
+        # update() runs one refresh at a time, only the state of a single
+        # car is locked while it is written
+        #
+        # no fleet wide interval, the scheduler and the category TTLs decide
+        # which cars and categories are due at this tick. The categories of
+        # new features are fetched in the same refresh.
+        new_features = self._update_cars_features(cur_time)
+        cars = self._get_due_cars(cur_time)
+        cars.extend(car for car in self.cars
+                    if car.finorvin in new_features and car not in cars)
+
+        car_states = self._fetch_cars_state(cars, cur_time)
+        for car in cars:
+            if car.finorvin in car_states:
+                with self._get_car_lock(car.finorvin):
+                    changed = self._set_car_state(
+                        car, *car_states[car.finorvin])
+                if changed:
+                    changed_cars[car.finorvin] = changed
+                self.scheduler.record(car, time.time())
+
+        self.last_update_time = cur_time
+
+        if changed_cars or new_features:
+            self._save_snapshot()
+        self._notify_update_listeners(changed_cars)
+        self._notify_feature_listeners(new_features)
+        return changed_cars
+
+    def _update_cars_features(self, now):
+        """ fetch the features of the cars whose features are due, see
+        feature_ttl.
+
+        Returns the activated features, {fin: feature names}.
+        """
+        cars = self._get_feature_due_cars(now)
+        futures = {car.finorvin: self._lanes.submit(
+            LANE_BACKGROUND, self._retrieve_car_features, car.finorvin)
+            for car in cars}
+
+        new_features = {}
+        for car in cars:
+            try:
+                features = futures[car.finorvin].result()
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Failed to get the features of car %s",
+                                  car.finorvin)
+                continue
 
-    def _get_cars(self):
+            activated = self._set_car_features(car, features)
+            if activated:
+                _LOGGER.info("%s activated for %s", sorted(activated),
+                             car.finorvin)
+                new_features[car.finorvin] = activated
+        return new_features
+
+    def _remove_car(self, car):
+        # a writer of the car must not write into the freed store slot
+        with self._get_car_lock(car.finorvin):
+            super()._remove_car(car)
+        self._car_locks.pop(car.finorvin, None)
+
+    def _get_car_lock(self, car_id):
+        lock = self._car_locks.get(car_id)
+        if lock is None:
+            lock = self._car_locks.setdefault(car_id, threading.Lock())
+        return lock
+
+    def _fetch_car_state(self, car, categories, force=False):
+        """ get dynamic state and location of a single car.
+
+        Endpoints whose categories are not due are skipped.
+        """
+        api_result = None
+        if categories.intersection(DYNAMIC_CATEGORIES):
+            api_result = self._retrieve_car_details(car.finorvin, force)
+            if force and api_result is not None:
+                self._set_forced_refresh_done(car.finorvin)
+
+        location_result = None
+        if LOCATION_CATEGORY in categories:
+            location_result = self._retrieve_location_details(car.finorvin)
+
+        return api_result, location_result, categories
+
+    def _fetch_cars_state(self, cars, now):
+        """ get dynamic state and location of all given cars.
+
+        Up to max_workers cars are fetched in parallel, so the time of a
+        refresh cycle follows the slowest car instead of the sum of all cars.
+        Every car is queued on its own in the background lane, a command or
+        targeted refresh runs as soon as a worker is done with its car.
+        """
+        categories = {car.finorvin: self._get_due_categories(car, now)
+                      for car in cars}
+        force = {car.finorvin: self._use_forced_refresh(car, now)
+                 for car in cars}
+
+        futures = {car.finorvin: self._lanes.submit(
+            LANE_BACKGROUND, self._fetch_car_state, car,
+            categories[car.finorvin], force[car.finorvin]) for car in cars}
+
+        results = {}
+        for fin, future in futures.items():
+            try:
+                results[fin] = future.result()
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Failed to update car %s", fin)
+        return results
+
+    def _get_cars(self, refresh_all=True):
+        """ get the cars of the account with their features and state.
+
+        Known cars are updated in place, their state is refreshed only with
+        refresh_all.
+        """
+        self._check_access_token()
 
         me_status_header = {
             "Accept-Language": self.accept_lang,
@@ -550,150 +1421,65 @@ class Controller(object):
             with open(f"{self.save_path}mercedesme_status.json", "w") as ofile:
                 json.dump(response.content.decode("utf8"), ofile)
 
-        for c in cars:
-
-            if c.get("fin") is None or c.get("fin") in self.excluded_cars:
-                continue
-
-            car = Car()
-            car.finorvin = c.get("fin")
-
-            car.licenseplate = c.get("licensePlate", "")
-
-            if not car.licenseplate:
-                car.licenseplate = car.finorvin
-
-            car.vehicle_title = c.get("vehicleTitle", None)
-            car.features = self._get_car_features(car.finorvin)
-
-            api_result = self._retrieve_car_details(
-                car.finorvin).get("dynamic")
-
-            # car.salesdesignation = detail.get("salesDesignation")
-
-            car.odometer = self._get_car_values(
-                api_result, car.finorvin, Odometer(), ODOMETER_OPTIONS)
-
-            car.tires = self._get_car_values(
-                api_result, car.finorvin, Tires(), TIRE_OPTIONS)
-            car.doors = self._get_car_values(
-                api_result, car.finorvin, Doors(), DOOR_OPTIONS)
-
-            if car.features.vehicle_locator:
-                car.location = self._get_location(car.finorvin)
-
-            car.binarysensors = self._get_car_values(
-                api_result, car.finorvin,
-                Binary_Sensors(), BINARY_SENSOR_OPTIONS)
+        added, removed = self._set_vehicles(cars)
 
-            car.windows = self._get_car_values(
-                api_result, car.finorvin, Windows(), WINDOW_OPTIONS)
+        # the features of the known cars are kept until feature_ttl
+        new_features = self._update_cars_features(time.time())
+        for car in added:
+            if car.features is None:
+                self._remove_car(car)
+        added = [car for car in added if car.features is not None]
 
-            _LOGGER.debug("_get_cars - Feature Check: charging_clima_control:%s ", {car.features.charging_clima_control})
-            if car.features.charging_clima_control:
-                car.electric = self._get_car_values(
-                    api_result, car.finorvin, Electric(), ELECTRIC_OPTIONS)
-
-            _LOGGER.debug("_get_cars - Feature Check: aux_heat:%s ", {car.features.aux_heat})
-            if car.features.aux_heat:
-                car.auxheat = self._get_car_values(
-                    api_result, car.finorvin, Auxheat(), AUX_HEAT_OPTIONS)
-
-            _LOGGER.debug("_get_cars - Feature Check: charging_clima_control:%s ", {car.features.charging_clima_control})
-            if car.features.charging_clima_control:
-                car.precond = self._get_car_values(
-                    api_result, car.finorvin, Precond(), PRE_COND_OPTIONS)
-
-            _LOGGER.debug("_get_cars - Feature Check: remote_engine_start:%s ", {car.features.remote_engine_start})
-            if car.features.remote_engine_start:
-                car.remote_start = self._get_car_values(
-                    api_result, car.finorvin, Remote_Start(), REMOTE_START_OPTIONS)
-
-            _LOGGER.debug("_get_cars - Feature Check: car_alarm:%s ", {car.features.car_alarm})
-            if car.features.car_alarm:
-                car.car_alarm = self._get_car_values(
-                    api_result, car.finorvin, Car_Alarm(), CAR_ALARM_OPTIONS)
-
-            self.cars.append(car)
-
-    def _get_location(self, car_id):
-        """ get refreshed location information."""
-        _LOGGER.debug("get_location for %s called", car_id)
-
-        api_result = self._retrieve_location_details(car_id)
-
-        _LOGGER.debug("get_location result: %s", api_result)
-
-        location = Location()
-
-        for loc_option in LOCATION_OPTIONS:
-            if api_result is not None:
-                curr_loc_option = api_result.get(loc_option)
-                value = CarAttribute(
-                    curr_loc_option,
-                    None,
-                    None)
-                setattr(location, loc_option, value)
-            else:
-                setattr(location, loc_option, CarAttribute(-1, -1, None))
-
-        return location
-
-    def _get_car_values(self, car_detail, car_id, classInstance, options):
-        _LOGGER.debug("get_car_values %s for %s called",
-                      classInstance.name, car_id)
-
-        for option in options:
-            if car_detail is not None:
-                curr = car_detail.get(option)
-                if curr is not None:
-                    curr_status = CarAttribute(
-                        curr.get("value"),
-                        curr.get("status"),
-                        car_detail.get("vtime")
-                    )
-                else:
-                    curr_status = CarAttribute(0, 4, 0)
-                setattr(classInstance, option, curr_status)
-            else:
-                setattr(classInstance, option, CarAttribute(-1, -1, None))
-
-        return classInstance
-
-    def _get_car_features(self, car_id):
+        if refresh_all:
+            cars = list(self.cars)
+        else:
+            cars = added + [car for car in self.cars
+                            if car.finorvin in new_features]
+
+        changed_cars = {}
+        car_states = self._fetch_cars_state(cars, time.time())
+        for car in cars:
+            with self._get_car_lock(car.finorvin):
+                changed = self._set_car_state(car, *car_states.get(
+                    car.finorvin,
+                    (None, None, self._get_due_categories(car, time.time()))))
+            if changed:
+                changed_cars[car.finorvin] = changed
+            self.scheduler.record(car, time.time())
+
+        self.is_warm = False
+        self._notify_update_listeners(changed_cars)
+        self._notify_feature_listeners(new_features)
+        self._notify_car_listeners([car.finorvin for car in added], removed)
+        self._save_snapshot()
+        return changed_cars
+
+    def _retrieve_car_features(self, car_id):
         _LOGGER.debug("_get_car_features for %s called", car_id)
 
-        features = self._retrieve_json_at_url(
+        result = self._retrieve_json_at_url(
             CAR_FEATURE_URL(URL_USR_API(self.region)) % car_id,
             self._get_default_header(),
             HTTP_GET,
             None)
 
-        car_features = Features()
-
-        if self.save_car_details:
-            with open(f"{self.save_path}feat_{car_id}.json", "w") as outfile:
-                json.dump(features, outfile)
-
-        for feature in features.get("metadata").get("featureEnablements"):
-            setattr(car_features,
-                    feature.get("name").lower(),
-                    feature.get("enablement") == "ACTIVATED")
+        if self.save_car_details and result is not None:
+            self._save_car_details(f"feat_{car_id}.json", result)
 
-        return car_features
+        return result
 
-    def _retrieve_car_details(self, fin):
+    def _retrieve_car_details(self, fin, force=False):
         header = self._get_default_header()
+        url = CAR_STATUS_FORCE_URL if force else CAR_STATUS_URL
 
         result = self._retrieve_json_at_url(
-            CAR_STATUS_URL(URL_VHS_API(self.region)) % fin,
+            url(URL_VHS_API(self.region)) % fin,
             header,
             HTTP_GET,
             None)
 
         if self.save_car_details:
-            with open(f"{self.save_path}state_{fin}.json", "w") as outfile:
-                json.dump(result, outfile)
+            self._save_car_details(f"state_{fin}.json", result)
 
         return result
 
@@ -712,7 +1498,13 @@ class Controller(object):
 
         return res
 
-    def _retrieve_json_at_url(self, url, headers, type, post_data=None):
+    def _retrieve_json_at_url(self, url, headers, type, post_data=None,
+                              session=None):
+        import requests
+
+        if session is None:
+            session = self.session
+
         try:
             if post_data is None:
                 _LOGGER.debug("Connect to URL %s %s %s", type, str(url), headers)
@@ -720,14 +1512,14 @@ class Controller(object):
                 _LOGGER.debug("Connect to URL %s %s %s %s", type, str(url), headers, post_data)
 
             if type == "get":
-                res = self.session.get(url,
-                                       verify=LOGIN_VERIFY_SSL_CERT,
-                                       headers=headers)
+                res = session.get(url,
+                                  verify=LOGIN_VERIFY_SSL_CERT,
+                                  headers=headers)
             else:
-                res = self.session.post(url,
-                                        verify=LOGIN_VERIFY_SSL_CERT,
-                                        headers=headers,
-                                        data=post_data)
+                res = session.post(url,
+                                   verify=LOGIN_VERIFY_SSL_CERT,
+                                   headers=headers,
+                                   data=post_data)
         except requests.exceptions.Timeout:
             _LOGGER.exception(
                 "Connection to the api timed out at URL %s", url)
@@ -739,25 +1531,5 @@ class Controller(object):
 
         return res.json()
 
-    def _get_bearer_token(self):
-        return "Bearer {}".format(self.auth_handler.token_info["access_token"])
-
-    def _get_default_header(self):
-        return {
-            "Accept-Language": self.accept_lang,
-            "Authorization": self._get_bearer_token(),
-            "country_code": self.country_code,
-            "User-Agent": APP_USER_AGENT,
-        }
-
     def _check_access_token(self):
-        if self.auth_handler.is_token_expired(self.auth_handler.token_info):
-            self.auth_handler.refresh_access_token(
-                self.auth_handler.token_info['refresh_token'])
-
-    def _round_current_time(self, roundTo=15):
-        t = datetime.datetime.now()  # type: datetime
-        t += datetime.timedelta(minutes=(roundTo + 1))
-        t += datetime.timedelta(minutes=(t.minute / roundTo) * roundTo - t.minute)
-        t -= datetime.timedelta(seconds=(t.second))
-        return t
+        self._tokens.get_token()
@@ -0,0 +1,502 @@
+# -*- coding: utf-8 -*-
+""" Asyncio Mercedes me API.
+
+Same data model as the Controller, but all requests run on a shared
+aiohttp session instead of blocking an executor thread.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from functools import partial
+
+import aiohttp
+
+from .apicontroller import (
+    BaseController,
+    CAR_FEATURE_URL,
+    CAR_LOCAT_URL,
+    CAR_STATUS_FORCE_URL,
+    CAR_STATUS_URL,
+    DEFAULT_FEATURE_TTL,
+    DEFAULT_FORCE_REFRESH_INTERVAL,
+    DEFAULT_STALE_THRESHOLD,
+    DYNAMIC_CATEGORIES,
+    HTTP_GET,
+    LOCATION_CATEGORY,
+    LOGIN_VERIFY_SSL_CERT,
+    ME_STATUS_URL,
+    URL_USR_API,
+    URL_VHS_API,
+)
+from .oauth import AsyncTokenManager
+from .singleflight import AsyncSingleFlight
+
+_LOGGER = logging.getLogger(__name__)
+
+REQUEST_TIMEOUT = 30
+
+
+class AsyncController(BaseController):
+    """ Asyncio Mercedes me API.
+
+    Call async_init before using the controller, the constructor does not
+    do any I/O.
+    """
+    is_async = True
+
+    def __init__(self, auth_handler, update_interval, accept_lang,
+                 country_code, excluded_cars, save_car_details,
+                 pin, save_path, max_workers=1, idle_update_interval=None,
+                 category_ttl=None,
+                 force_refresh_interval=DEFAULT_FORCE_REFRESH_INTERVAL,
+                 stale_threshold=DEFAULT_STALE_THRESHOLD, warm_start=False,
+                 feature_ttl=DEFAULT_FEATURE_TTL, session=None):
+
+        super().__init__(auth_handler, update_interval, accept_lang,
+                         country_code, excluded_cars, save_car_details,
+                         pin, save_path, max_workers, idle_update_interval,
+                         category_ttl, force_refresh_interval, stale_threshold,
+                         warm_start, feature_ttl)
+
+        self.session = session
+        self._tokens = AsyncTokenManager(auth_handler, session)
+        self._command_tasks = set()
+        self._single_flight = AsyncSingleFlight()
+        # an update and a discovery do not change the car list at once
+        self._fleet_lock = asyncio.Lock()
+
+    async def async_init(self):
+        self._tokens.start()
+        loop = asyncio.get_event_loop()
+        if self.warm_start and \
+           await loop.run_in_executor(None, self._load_snapshot):
+            _LOGGER.debug("AsyncController init. Warm start")
+        else:
+            _LOGGER.debug("AsyncController init. Start _async_get_cars")
+            await self._async_get_cars()
+
+    def stop(self):
+        """ stop the background token refresh, must be called in the event
+        loop."""
+        self._tokens.stop()
+
+    async def async_revalidate(self):
+        """ get the cars, their features and state from the API after a
+        warm start, see Controller.revalidate."""
+        _LOGGER.debug("Async revalidate start")
+        return await self._single_flight.do(
+            "update", self._async_run_locked, self._async_get_cars)
+
+    async def async_discover(self):
+        """ look for cars added to or removed from the account, see
+        Controller.discover."""
+        _LOGGER.debug("Async discovery start")
+        return await self._single_flight.do(
+            "discover", self._async_run_locked, self._async_get_cars, False)
+
+    async def async_update(self):
+        """ refresh the due cars.
+
+        Returns the change sets of the changed cars, {fin: attribute names}.
+        """
+        _LOGGER.debug("Async update start")
+        return await self._single_flight.do(
+            "update", self._async_run_locked, self._async_update_cars)
+
+    async def _async_run_locked(self, function, *args):
+        async with self._fleet_lock:
+            return await function(*args)
+
+    async def async_refresh_car(self, car_id, categories):
+        """ refresh some categories of a single car right away.
+
+        The car is woken up for a fresh state, the update_interval and the
+        poll interval of the car do not apply. Concurrent refreshes of the
+        same car and categories share one request. Returns the change set
+        of the car.
+        """
+        return await self._single_flight.do(
+            ("refresh", car_id, frozenset(categories)),
+            self._async_refresh_car, car_id, categories)
+
+    async def _async_refresh_car(self, car_id, categories):
+        car = self.get_car(car_id)
+        if car is None or not categories:
+            return set()
+
+        _LOGGER.debug("refresh %s of %s", sorted(categories), car_id)
+        await self._async_check_access_token()
+        car_state = await self._async_fetch_car_state(car, set(categories), True)
+
+        changed = self._set_car_state(car, *car_state)
+
+        if changed:
+            await self._async_save_snapshot()
+            self._notify_update_listeners({car_id: changed})
+        return changed
+
+    async def async_lock(self, car_id):
+        return await self._async_execute_car_action(
+            *self._get_car_action("lock", car_id))
+
+    async def async_unlock(self, car_id):
+        return await self._async_execute_car_action(
+            *self._get_car_action("unlock", car_id))
+
+    async def async_switch_car_feature(self, action=None, car_id=None):
+        if action == "climate_on":
+            return await self.async_climate_on(car_id)
+
+        return await self._async_execute_car_action(
+            *self._get_car_action(action, car_id))
+
+    async def async_batch_lock(self, selector="all"):
+        return await self.async_batch_command("lock", selector)
+
+    async def async_batch_unlock(self, selector="all"):
+        return await self.async_batch_command("unlock", selector)
+
+    async def async_batch_switch_car_feature(self, action, selector="all"):
+        return await self.async_batch_command(action, selector)
+
+    async def async_batch_command(self, action, selector="all"):
+        """ send a command to several cars, see _get_selected_car_ids.
+
+        At most max_workers commands are sent at the same time. Returns
+        {fin: result} of the selected cars.
+        """
+        if action == "lock":
+            function = self.async_lock
+        elif action == "unlock":
+            function = self.async_unlock
+        else:
+            function = partial(self.async_switch_car_feature, action)
+
+        car_ids = self._get_selected_car_ids(selector)
+        _LOGGER.debug("%s for %s called", action, car_ids)
+        semaphore = asyncio.Semaphore(max(self.max_workers, 1))
+
+        async def execute(car_id):
+            async with semaphore:
+                return await function(car_id)
+
+        results = await asyncio.gather(
+            *[execute(car_id) for car_id in car_ids], return_exceptions=True)
+
+        batch_results = {}
+        for car_id, result in zip(car_ids, results):
+            if isinstance(result, Exception):
+                _LOGGER.error("Failed to execute action %s for car %s: %s",
+                              action, car_id, result)
+                result = False
+            batch_results[car_id] = result
+        return batch_results
+
+    async def async_climate_on(self, car_id):
+        return await self._async_execute_car_action(
+            *self._get_car_action("climate_on", car_id),
+            on_success=partial(self._async_execute_car_action,
+                               *self._get_car_action("climate_conf", car_id)))
+
+    async def _async_execute_car_action(self, url, car_id, action, pin,
+                                        post_data=None, on_success=None):
+        """ send a command without waiting for its result.
+
+        The status of a pending command is polled in a background task, see
+        self.commands for the result. on_success is awaited after the
+        command succeeded. Returns False if the command failed right away.
+
+        A command that is already being sent or pending for the car is not
+        sent again, the caller joins it.
+        """
+        return await self._single_flight.do(
+            ("command", car_id, action), self._async_send_car_action,
+            url, car_id, action, pin, post_data, on_success)
+
+    async def _async_send_car_action(self, url, car_id, action, pin,
+                                     post_data, on_success):
+        _LOGGER.debug("%s for %s called", action, car_id)
+        if self._is_command_pending(car_id, action):
+            return True
+
+        await self._async_check_access_token()
+        header = self._get_action_header(pin, post_data)
+        command = self.commands.start(car_id, action)
+
+        try:
+            result = await self._async_retrieve_json_at_url(
+                url % car_id, header, "post", post_data)
+        except BaseException:
+            # a failed or cancelled request fails the command, it must not
+            # stay pending
+            self.commands.set_result(command, None)
+            raise
+
+        _LOGGER.debug(result)
+
+        if self.commands.set_result(command, result):
+            task = asyncio.ensure_future(self._async_poll_command(
+                command, url % car_id, header, on_success))
+            self._command_tasks.add(task)
+            task.add_done_callback(self._command_tasks.discard)
+            return True
+
+        return await self._async_set_command_result(command, on_success)
+
+    async def _async_poll_command(self, command, url, header, on_success):
+        while True:
+            await asyncio.sleep(max(command.next_poll - time.time(), 0))
+            try:
+                result = await self._async_retrieve_json_at_url(
+                    url, header, "get", None)
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Failed to poll %s for %s",
+                                  command.action, command.car_id)
+                result = None
+            _LOGGER.debug(result)
+
+            if not self.commands.set_result(command, result):
+                break
+
+        await self._async_set_command_result(command, on_success)
+
+    async def _async_set_command_result(self, command, on_success=None):
+        if not self._get_command_succeeded(command):
+            return False
+
+        # a chained command goes first, the refresh runs in its own task
+        if on_success is not None:
+            await on_success()
+        task = asyncio.ensure_future(self.async_refresh_car(
+            command.car_id, self._get_command_categories(command)))
+        self._command_tasks.add(task)
+        task.add_done_callback(self._command_tasks.discard)
+        return True
+
+    async def _async_update_cars(self):
+        cur_time = time.time()
+        changed_cars = {}
+        await self._async_check_access_token()
+
+        # async_update() runs one refresh at a time, the state of a car is
+        # written without an await in between
+        #
+        # no fleet wide interval, the scheduler and the category TTLs decide
+        # which cars and categories are due at this tick. The categories of
+        # new features are fetched in the same refresh.
+        new_features = await self._async_update_cars_features(cur_time)
+        cars = self._get_due_cars(cur_time)
+        cars.extend(car for car in self.cars
+                    if car.finorvin in new_features and car not in cars)
+
+        car_states = await self._async_fetch_cars_state(cars, cur_time)
+        for car in cars:
+            if car.finorvin in car_states:
+                changed = self._set_car_state(
+                    car, *car_states[car.finorvin])
+                if changed:
+                    changed_cars[car.finorvin] = changed
+                self.scheduler.record(car, time.time())
+
+        self.last_update_time = cur_time
+
+        if changed_cars or new_features:
+            await self._async_save_snapshot()
+        self._notify_update_listeners(changed_cars)
+        self._notify_feature_listeners(new_features)
+        return changed_cars
+
+    async def _async_update_cars_features(self, now):
+        """ fetch the features of the cars whose features are due, see
+        Controller._update_cars_features."""
+        cars = self._get_feature_due_cars(now)
+        results = await asyncio.gather(
+            *[self._async_retrieve_json_at_url(
+                CAR_FEATURE_URL(URL_USR_API(self.region)) % car.finorvin,
+                self._get_default_header(),
+                HTTP_GET) for car in cars], return_exceptions=True)
+
+        new_features = {}
+        for car, features in zip(cars, results):
+            if isinstance(features, Exception):
+                _LOGGER.error("Failed to get the features of car %s: %s",
+                              car.finorvin, features)
+                continue
+
+            if self.save_car_details and features is not None:
+                await self._async_save_car_details(
+                    f"feat_{car.finorvin}.json", features)
+            activated = self._set_car_features(car, features)
+            if activated:
+                _LOGGER.info("%s activated for %s", sorted(activated),
+                             car.finorvin)
+                new_features[car.finorvin] = activated
+        return new_features
+
+    async def _async_fetch_car_state(self, car, categories, force=False):
+        """ get dynamic state and location of a single car.
+
+        Endpoints whose categories are not due are skipped.
+        """
+        api_result = None
+        if categories.intersection(DYNAMIC_CATEGORIES):
+            api_result = await self._async_retrieve_car_details(
+                car.finorvin, force)
+            if force and api_result is not None:
+                self._set_forced_refresh_done(car.finorvin)
+
+        location_result = None
+        if LOCATION_CATEGORY in categories:
+            location_result = await self._async_retrieve_location_details(
+                car.finorvin)
+
+        return api_result, location_result, categories
+
+    async def _async_fetch_cars_state(self, cars, now):
+        """ get dynamic state and location of all given cars.
+
+        At most max_workers cars are requested at the same time.
+        """
+        semaphore = asyncio.Semaphore(max(self.max_workers, 1))
+
+        async def fetch(car):
+            async with semaphore:
+                return await self._async_fetch_car_state(
+                    car, self._get_due_categories(car, now),
+                    self._use_forced_refresh(car, now))
+
+        results = await asyncio.gather(
+            *[fetch(car) for car in cars], return_exceptions=True)
+
+        car_states = {}
+        for car, result in zip(cars, results):
+            if isinstance(result, Exception):
+                _LOGGER.error("Failed to update car %s: %s",
+                              car.finorvin, result)
+                continue
+            car_states[car.finorvin] = result
+        return car_states
+
+    async def _async_save_car_details(self, file_name, data):
+        await asyncio.get_event_loop().run_in_executor(
+            None, self._save_car_details, file_name, data)
+
+    async def _async_save_snapshot(self):
+        if self.warm_start:
+            await asyncio.get_event_loop().run_in_executor(
+                None, self._save_snapshot)
+
+    async def _async_get_cars(self, refresh_all=True):
+        """ get the cars of the account with their features and state.
+
+        Known cars are updated in place, their state is refreshed only with
+        refresh_all.
+        """
+        await self._async_check_access_token()
+
+        me_status_header = {
+            "Accept-Language": self.accept_lang,
+            "Authorization": self._get_bearer_token()
+        }
+        response = await self._async_retrieve_json_at_url(
+            ME_STATUS_URL(URL_USR_API(self.region)),
+            me_status_header,
+            HTTP_GET)
+
+        _LOGGER.debug("Me_status_response: %s", response)
+
+        if response is None:
+            return {}
+
+        if self.save_car_details:
+            await self._async_save_car_details(
+                "mercedesme_status.json", json.dumps(response))
+
+        added, removed = self._set_vehicles(response['vehicles'])
+
+        # the features of the known cars are kept until feature_ttl
+        new_features = await self._async_update_cars_features(time.time())
+        for car in added:
+            if car.features is None:
+                self._remove_car(car)
+        added = [car for car in added if car.features is not None]
+
+        if refresh_all:
+            cars = list(self.cars)
+        else:
+            cars = added + [car for car in self.cars
+                            if car.finorvin in new_features]
+
+        changed_cars = {}
+        car_states = await self._async_fetch_cars_state(cars, time.time())
+        for car in cars:
+            changed = self._set_car_state(car, *car_states.get(
+                car.finorvin,
+                (None, None, self._get_due_categories(car, time.time()))))
+            if changed:
+                changed_cars[car.finorvin] = changed
+            self.scheduler.record(car, time.time())
+
+        self.is_warm = False
+        self._notify_update_listeners(changed_cars)
+        self._notify_feature_listeners(new_features)
+        self._notify_car_listeners([car.finorvin for car in added], removed)
+        await self._async_save_snapshot()
+        return changed_cars
+
+    async def _async_retrieve_car_details(self, fin, force=False):
+        url = CAR_STATUS_FORCE_URL if force else CAR_STATUS_URL
+
+        result = await self._async_retrieve_json_at_url(
+            url(URL_VHS_API(self.region)) % fin,
+            self._get_default_header(),
+            HTTP_GET)
+
+        if self.save_car_details:
+            await self._async_save_car_details(f"state_{fin}.json", result)
+
+        return result
+
+    async def _async_retrieve_location_details(self, car_id):
+        _LOGGER.debug("get location for %s called", car_id)
+
+        header = self._get_default_header()
+        header['lat'] = "1"
+        header['lon'] = "1"
+
+        return await self._async_retrieve_json_at_url(
+            CAR_LOCAT_URL(URL_VHS_API(self.region)) % car_id,
+            header,
+            HTTP_GET)
+
+    async def _async_retrieve_json_at_url(self, url, headers, type,
+                                          post_data=None):
+        if post_data is None:
+            _LOGGER.debug("Connect to URL %s %s %s", type, str(url), headers)
+        else:
+            _LOGGER.debug("Connect to URL %s %s %s %s", type, str(url), headers, post_data)
+
+        try:
+            async with self.session.request(
+                    type.upper(), url,
+                    headers=headers,
+                    data=post_data,
+                    ssl=None if LOGIN_VERIFY_SSL_CERT else False,
+                    timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)) as res:
+                if res.status != 200:
+                    _LOGGER.error(
+                        "Connection failed with http code %s", res.status)
+                    return
+
+                return await res.json(content_type=None)
+        except asyncio.TimeoutError:
+            _LOGGER.error(
+                "Connection to the api timed out at URL %s", url)
+        except aiohttp.ClientError as err:
+            _LOGGER.error(
+                "Connection to the api failed at URL %s: %s", url, err)
+
+    async def _async_check_access_token(self):
+        await self._tokens.async_get_token()
@@ -7,11 +7,14 @@ https://github.com/ReneNulschDE/mbapipy/
 import logging
 
 from homeassistant.components.binary_sensor import BinarySensorEntity
+from homeassistant.core import callback
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from . import (
     DOMAIN,
     CONF_TIRE_WARNING_INDICATOR,
     CONF_CARS,
     CONF_CARS_VIN,
+    SIGNAL_ADD_ENTITIES,
     MercedesMeEntity)
 from .const import BINARY_SENSORS
 
@@ -27,45 +30,66 @@ async def async_setup_platform(hass, config, async_add_devices,
     data = hass.data[DOMAIN].data
     conf = hass.data[DOMAIN].config
 
+    @callback
+    def async_add_car_devices(vin, features):
+        """Add the binary sensors of features activated after the setup."""
+        car = data.get_car(vin)
+        if car is not None:
+            async_add_devices(
+                _get_devices(hass, data, conf, car, features), True)
+
+    async_dispatcher_connect(hass, SIGNAL_ADD_ENTITIES, async_add_car_devices)
+
     if not data.cars:
         _LOGGER.error("No cars found. Check component log.")
         return
 
     devices = []
     for car in data.cars:
-
-        tire_warning_field = "tirewarninglamp"
-        if conf.get(CONF_CARS) is not None:
-            for car_conf in conf.get(CONF_CARS):
-                if car_conf.get(CONF_CARS_VIN) == car.finorvin:
-                    tire_warning_field = car_conf.get(
-                        CONF_TIRE_WARNING_INDICATOR)
-                    break
-
-        for key, value in sorted(BINARY_SENSORS.items()):
-            if key == "tirewarninglamp":
-                value[3] = tire_warning_field
-
-            if value[5] is None or getattr(car.features, value[5]) is True:
-                device = MercedesMEBinarySensor(
-                    hass,
-                    data,
-                    key,
-                    value[0],
-                    car.finorvin,
-                    value[1],
-                    car.licenseplate,
-                    value[2],
-                    value[3],
-                    value[4],
-                    value[6],
-                )
-                if device.device_retrieval_status() == "VALID":
-                    devices.append(device)
+        devices.extend(_get_devices(hass, data, conf, car))
 
     async_add_devices(devices, True)
 
 
+def _get_devices(hass, data, conf, car, features=None):
+    """Get the binary sensors of a car, only the ones of the given features
+    if set."""
+    tire_warning_field = "tirewarninglamp"
+    if conf.get(CONF_CARS) is not None:
+        for car_conf in conf.get(CONF_CARS):
+            if car_conf.get(CONF_CARS_VIN) == car.finorvin:
+                tire_warning_field = car_conf.get(
+                    CONF_TIRE_WARNING_INDICATOR)
+                break
+
+    devices = []
+    for key, value in sorted(BINARY_SENSORS.items()):
+        if features is not None and value[5] not in features:
+            continue
+
+        if key == "tirewarninglamp":
+            value[3] = tire_warning_field
+
+        if value[5] is None or getattr(car.features, value[5]) is True:
+            device = MercedesMEBinarySensor(
+                hass,
+                data,
+                key,
+                value[0],
+                car.finorvin,
+                value[1],
+                car.licenseplate,
+                value[2],
+                value[3],
+                value[4],
+                value[6],
+            )
+            if device.device_retrieval_status() == "VALID":
+                devices.append(device)
+
+    return devices
+
+
 class MercedesMEBinarySensor(MercedesMeEntity, BinarySensorEntity):
     """Representation of a Sensor."""
 
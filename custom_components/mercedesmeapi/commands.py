@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+""" Status tracking of the Mercedes me car commands.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+COMMAND_PENDING = "PENDING"
+COMMAND_SUCCESS = "SUCCESS"
+COMMAND_FAILED = "FAILED"
+
+# seconds between the status polls of a pending command, doubled per poll
+COMMAND_POLL_DELAY = 1
+COMMAND_POLL_MAX_DELAY = 15
+# a pending command fails after x seconds
+COMMAND_TIMEOUT = 90
+
+
+class Command(object):
+    def __init__(self, car_id, action, started):
+        self.car_id = car_id
+        self.action = action
+        self.status = COMMAND_PENDING
+        self.started = started
+        self.finished = None
+        self.delay = COMMAND_POLL_DELAY
+        self.next_poll = started + COMMAND_POLL_DELAY
+
+    @property
+    def is_done(self):
+        return self.status != COMMAND_PENDING
+
+
+class CommandTracker(object):
+    """ Status of the submitted commands, the last command per car and action.
+
+    A pending command polls its status with exponential backoff until it
+    succeeds, fails or times out. The listeners are called with the command
+    when it starts and when it is done.
+    """
+    def __init__(self, timeout=COMMAND_TIMEOUT,
+                 max_delay=COMMAND_POLL_MAX_DELAY):
+        self.timeout = timeout
+        self.max_delay = max_delay
+        self._commands = {}
+        self._listeners = []
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def get_command(self, car_id, action):
+        return self._commands.get((car_id, action))
+
+    def get_last_command(self, car_id, actions):
+        """ get the latest command of a car out of several actions."""
+        commands = [self._commands[(car_id, action)] for action in actions
+                    if (car_id, action) in self._commands]
+        return max(commands, key=lambda command: command.started,
+                   default=None)
+
+    def start(self, car_id, action):
+        command = Command(car_id, action, time.time())
+        self._commands[(car_id, action)] = command
+        self._notify(command)
+        return command
+
+    def set_result(self, command, result):
+        """ update a command with the result of a command request.
+
+        Returns True while the command is pending, next_poll is the time of
+        the next status poll then.
+        """
+        now = time.time()
+
+        # a failed request fails the command, any other status than
+        # SUCCESS and FAILED keeps it pending
+        status = result.get("status") if result is not None else COMMAND_FAILED
+        if status in [COMMAND_SUCCESS, COMMAND_FAILED]:
+            self._finish(command, status, now)
+            return False
+
+        if now - command.started >= self.timeout:
+            _LOGGER.warning("%s for %s timed out", command.action,
+                            command.car_id)
+            self._finish(command, COMMAND_FAILED, now)
+            return False
+
+        command.next_poll = now + command.delay
+        command.delay = min(command.delay * 2, self.max_delay)
+        return True
+
+    def _finish(self, command, status, now):
+        command.status = status
+        command.finished = now
+        _LOGGER.debug("%s for %s %s after %.1f seconds", command.action,
+                      command.car_id, status, now - command.started)
+        self._notify(command)
+
+    def _notify(self, command):
+        for listener in self._listeners:
+            try:
+                listener(command)
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Error in command listener %s", listener)
+
+
+class CommandPoller(object):
+    """ Polls the status of all pending commands in one background thread.
+
+    The thread is started with the first pending command and ends when no
+    command is pending anymore.
+    """
+    def __init__(self, tracker):
+        self._tracker = tracker
+        self._queue = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def submit(self, command, poll, done):
+        """ poll() requests the status of the command, done(command) is
+        called in the poller thread when the command is done. done must
+        not block, slow work belongs in a worker."""
+        with self._condition:
+            heapq.heappush(self._queue, (command.next_poll,
+                                         next(self._counter),
+                                         command, poll, done))
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="mercedesmeapi_commands",
+                    daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._queue:
+                    self._thread = None
+                    return
+
+                next_poll, _, command, poll, done = self._queue[0]
+                wait = next_poll - time.time()
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+
+                heapq.heappop(self._queue)
+
+            try:
+                result = poll()
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Failed to poll %s for %s",
+                                  command.action, command.car_id)
+                result = None
+
+            if self._tracker.set_result(command, result):
+                self.submit(command, poll, done)
+                continue
+
+            try:
+                done(command)
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Error after %s for %s",
+                                  command.action, command.car_id)
@@ -1,6 +1,16 @@
 from homeassistant.const import (
     LENGTH_KILOMETERS)
 
+from .apicontroller import (
+    AUX_HEAT_OPTIONS,
+    CAR_ALARM_OPTIONS,
+    DOOR_OPTIONS,
+    ELECTRIC_OPTIONS,
+    ODOMETER_OPTIONS,
+    REMOTE_START_OPTIONS,
+    TIRE_OPTIONS,
+)
+
 MERCEDESME_COMPONENTS = [
     "sensor",
     "lock",
@@ -90,20 +100,7 @@ BINARY_SENSORS = {
                         "OVERWRITTEN_IN_BINARY_SENSOR",
                         "value",
                         None,
-                        {
-                            "tirepressureRearLeft",
-                            "tirepressureRearRight",
-                            "tirepressureFrontRight",
-                            "tirepressureFrontLeft",
-                            "tirewarningsrdk",
-                            "tirewarningsprw",
-                            "tireMarkerFrontRight",
-                            "tireMarkerFrontLeft",
-                            "tireMarkerRearLeft",
-                            "tireMarkerRearRight",
-                            "tireWarningRollup",
-                            "tirewarninglamp",
-                            "lastTirepressureTimestamp"}]
+                        set(TIRE_OPTIONS)]
 }
 
 LOCKS = {
@@ -125,67 +122,22 @@ SWITCHES = {
         "Remote Start", None, "remote_start",
         "remoteEngine", "value",
         "remote_engine_start",
-        {
-            "remoteEngine",
-            "remoteStartEndtime",
-            "remoteStartTemperature"},
+        set(REMOTE_START_OPTIONS),
         "remote_start"],
 }
 
 SENSORS = {
     "lock": ["Lock", None, "doors", "locked", "value", None,
-             {
-                 "fuelLidClosed",
-                 "doorStateFrontLeft",
-                 "doorStateFrontRight",
-                 "doorStateRearLeft",
-                 "doorStateRearRight",
-                 "frontLeftDoorLocked",
-                 "frontRightDoorLocked",
-                 "rearLeftDoorLocked",
-                 "rearRightDoorLocked",
-                 "frontLeftDoorClosed",
-                 "frontRightDoorClosed",
-                 "rearLeftDoorClosed",
-                 "rearRightDoorClosed",
-                 "rearRightDoorClosed",
-                 "doorsClosed",
-                 "trunkStateRollup",
-                 "sunroofstatus",
-                 "engineHoodClosed", }],
+             set(DOOR_OPTIONS) - {"locked"}],
 
     "rangeElectricKm": ["Range Electric", LENGTH_KILOMETERS,
                         "electric", "rangeElectricKm",
                         "value", "charging_clima_control",
-                        {
-                            "rangeelectric",
-                            "rangeElectricKm",
-                            "criticalStateOfSoc",
-                            "maxrange",
-                            "stateOfChargeElectricPercent",
-                            "endofchargetime",
-                            "criticalStateOfDeparturetimesoc",
-                            "warninglowbattery",
-                            "electricconsumptionreset",
-                            "maxStateOfChargeElectricPercent",
-                            "supplybatteryvoltage",
-                            "electricChargingStatus",
-                            "chargingstatus",
-                            "soc",
-                            "showChargingErrorAndDemand",
-                            "electricconsumptionstart"}],
+                        set(ELECTRIC_OPTIONS)],
 
     "auxheatstatus": ["Auxheat Status", None, "auxheat", "auxheatstatus",
                       "value", "aux_heat",
-                      {
-                          "auxheatActive",
-                          "auxheatwarnings",
-                          "auxheatruntime",
-                          "auxheatwarningsPush",
-                          "auxheattimeselection",
-                          "auxheattime1",
-                          "auxheattime2",
-                          "auxheattime3"}],
+                      set(AUX_HEAT_OPTIONS) - {"auxheatstatus"}],
 
     "tanklevelpercent": ["Fuel Level", "%", "odometer", "tanklevelpercent",
                          "value", None,
@@ -195,49 +147,10 @@ SENSORS = {
 
     "odometer": ["Odometer", LENGTH_KILOMETERS, "odometer", "odo",
                  "value", None,
-                 {
-                     "distanceReset",
-                     "distanceStart",
-                     "averageSpeedReset",
-                     "averageSpeedStart",
-                     "distanceZEReset",
-                     "drivenTimeZEReset",
-                     "drivenTimeReset",
-                     "drivenTimeStart",
-                     "ecoscoretotal",
-                     "ecoscorefreewhl",
-                     "ecoscorebonusrange",
-                     "ecoscoreconst",
-                     "ecoscoreaccel",
-                     "gasconsumptionstart",
-                     "gasconsumptionreset",
-                     "gasTankRange",
-                     "gasTankLevel",
-                     "liquidconsumptionstart",
-                     "liquidconsumptionreset",
-                     "liquidRangeSkipIndication",
-                     "rangeliquid",
-                     "serviceintervaldays",
-                     "tanklevelpercent",
-                     "tankReserveLamp",
-                     "batteryState",
-                     "tankLevelAdBlue"}],
+                 set(ODOMETER_OPTIONS) - {"odo"}],
 
     "car_alarm": ["Car Alarm", None, "car_alarm", "carAlarm",
                   "value", 'car_alarm',
-                  {
-                      "lastTheftWarning",
-                      "towSensor",
-                      "theftSystemArmed",
-                      "parkEventType",
-                      "parkEventLevel",
-                      "carAlarmLastTime",
-                      "towProtectionSensorStatus",
-                      "theftAlarmActive",
-                      "lastTheftWarningReason",
-                      "lastParkEvent",
-                      "collisionAlarmTimestamp",
-                      "interiorSensor",
-                      "carAlarmReason"}],
+                  set(CAR_ALARM_OPTIONS) - {"carAlarm"}],
 
 }
@@ -25,9 +25,7 @@ def setup_scanner(hass, config, see, discovery_info=None):
 
     data = hass.data[DOMAIN].data
 
-    if not data.cars:
-        return False
-
+    # scans data.cars, cars found by the discovery are tracked as well
     MercedesMEDeviceTracker(hass, config, see, data)
 
     return True
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+""" Thread pool with priority lanes for the Mercedes me API requests.
+"""
+
+from concurrent.futures import Future
+import itertools
+import queue
+import threading
+
+# lanes, a lower lane runs first
+LANE_COMMAND = 0
+LANE_TARGETED = 1
+LANE_BACKGROUND = 2
+
+
+class LaneExecutor(object):
+    """ Thread pool that runs the queued calls by lane.
+
+    Interactive commands run first, then targeted refreshes, then the
+    background polling. Background work is queued per car, so a worker
+    picks up a command after the car it is fetching and the latency of a
+    command does not grow with the fleet size. Calls of the same lane run
+    in submit order.
+
+    A call must not wait for another call of the executor.
+    """
+    def __init__(self, max_workers, thread_name_prefix="mercedesmeapi"):
+        self.max_workers = max(max_workers, 1)
+        self._thread_name_prefix = thread_name_prefix
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, lane, function, *args, **kwargs):
+        future = Future()
+        self._queue.put((lane, next(self._counter), future, function, args,
+                         kwargs))
+
+        with self._lock:
+            if len(self._threads) < self.max_workers:
+                thread = threading.Thread(
+                    target=self._work,
+                    name=f"{self._thread_name_prefix}_{len(self._threads)}",
+                    daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+        return future
+
+    def run(self, lane, function, *args, **kwargs):
+        """ run a call in its lane and wait for the result."""
+        return self.submit(lane, function, *args, **kwargs).result()
+
+    def _work(self):
+        while True:
+            _, _, future, function, args, kwargs = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                result = function(*args, **kwargs)
+            except BaseException as err:  # pylint: disable=broad-except
+                future.set_exception(err)
+            else:
+                future.set_result(result)
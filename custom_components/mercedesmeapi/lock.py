@@ -8,8 +8,13 @@ import logging
 
 from homeassistant.components.lock import LockEntity
 from homeassistant.const import STATE_LOCKED, STATE_UNLOCKED
+from homeassistant.core import callback
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
 
-from custom_components.mercedesmeapi import DOMAIN, MercedesMeEntity
+from custom_components.mercedesmeapi import (
+    DOMAIN,
+    SIGNAL_ADD_ENTITIES,
+    MercedesMeEntity)
 from .const import LOCKS
 
 DEPENDENCIES = ['mercedesmeapi']
@@ -25,34 +30,59 @@ async def async_setup_platform(hass, config, async_add_devices,
 
     data = hass.data[DOMAIN].data
 
+    @callback
+    def async_add_car_devices(vin, features):
+        """Add the locks of features activated after the setup."""
+        car = data.get_car(vin)
+        if car is not None:
+            async_add_devices(_get_devices(hass, data, car, features), True)
+
+    async_dispatcher_connect(hass, SIGNAL_ADD_ENTITIES, async_add_car_devices)
+
     if not data.cars:
         _LOGGER.info("No Cars found.")
         return
 
     devices = []
     for car in data.cars:
-        for key, value in sorted(LOCKS.items()):
-            if value[5] is None or getattr(car.features, value[5]) is True:
-                devices.append(
-                    MercedesMELock(
-                        hass,
-                        data,
-                        key,
-                        value[0],
-                        car.finorvin,
-                        value[1],
-                        car.licenseplate,
-                        value[2],
-                        value[3],
-                        value[4],
-                        None))
+        devices.extend(_get_devices(hass, data, car))
 
     async_add_devices(devices, True)
 
 
+def _get_devices(hass, data, car, features=None):
+    """Get the locks of a car, only the ones of the given features if set."""
+    devices = []
+    for key, value in sorted(LOCKS.items()):
+        if features is not None and value[5] not in features:
+            continue
+
+        if value[5] is None or getattr(car.features, value[5]) is True:
+            devices.append(
+                MercedesMELock(
+                    hass,
+                    data,
+                    key,
+                    value[0],
+                    car.finorvin,
+                    value[1],
+                    car.licenseplate,
+                    value[2],
+                    value[3],
+                    value[4],
+                    None))
+
+    return devices
+
+
 class MercedesMELock(MercedesMeEntity, LockEntity):
     """Representation of a Sensor."""
 
+    @property
+    def command_actions(self):
+        """Return the command actions whose status the entity shows."""
+        return ("lock", "unlock")
+
     @property
     def is_locked(self):
         """Get whether the lock is in locked state."""
@@ -62,14 +92,42 @@ class MercedesMELock(MercedesMeEntity, LockEntity):
     def lock(self, **kwargs):
         """Send the lock command."""
         _LOGGER.debug("Locking doors for: %s", self._name)
-        self._data.lock(self._vin)
+        return self._data.lock(self._vin)
 
     def unlock(self, **kwargs):
         """Send the unlock command."""
         _LOGGER.debug("Unlocking doors for: %s", self._name)
-        self._data.unlock(self._vin)
+        return self._data.unlock(self._vin)
+
+    async def async_lock(self, **kwargs):
+        """Send the lock command."""
+        if not self._data.is_async:
+            await self._async_send_command(
+                STATE_LOCKED, self.hass.async_add_executor_job, self.lock)
+            return
+
+        _LOGGER.debug("Locking doors for: %s", self._name)
+        await self._async_send_command(
+            STATE_LOCKED, self._data.async_lock, self._vin)
+
+    async def async_unlock(self, **kwargs):
+        """Send the unlock command."""
+        if not self._data.is_async:
+            await self._async_send_command(
+                STATE_UNLOCKED, self.hass.async_add_executor_job, self.unlock)
+            return
+
+        _LOGGER.debug("Unlocking doors for: %s", self._name)
+        await self._async_send_command(
+            STATE_UNLOCKED, self._data.async_unlock, self._vin)
 
     @property
     def state(self):
         """Return the state of the sensor."""
+        if self._optimistic_state is not None:
+            return self._optimistic_state
+
+        return self._get_device_state()
+
+    def _get_device_state(self):
         return STATE_LOCKED if self._state else STATE_UNLOCKED
@@ -1,17 +1,19 @@
 """ OAuth class.
 """
 
+import asyncio
 import base64
 import hashlib
 import json
 import logging
+import os
+import threading
 import time
 from os import urandom
 
 from urllib.parse import parse_qs, urlparse
 
-import requests
-import lxml.html
+from .singleflight import AsyncSingleFlight, SingleFlight
 
 # Set to False for testing with tools like fiddler
 # Change to True for production
@@ -19,6 +21,17 @@ LOGIN_VERIFY_SSL_CERT = True
 URL_LOGIN = "https://login.secure.mercedes-benz.com"
 URL_API = "https://api.secure.mercedes-benz.com"
 
+# format of the token cache file, a file without version is a plain token_info
+TOKEN_CACHE_VERSION = 1
+
+# the token is refreshed in the background x seconds before it expires
+TOKEN_REFRESH_MARGIN = 300
+# a failed background refresh is retried after x seconds
+TOKEN_RETRY_DELAY = 60
+# a failed login is retried after x seconds, doubled per failure
+LOGIN_RETRY_DELAY = 60
+LOGIN_MAX_RETRY_DELAY = 3600
+
 ANDROID_USERAGENT = (
     "Mozilla/5.0 (Linux; Android 5.1; "
     "Google Nexus 5 Build/LMY47D) AppleWebKit/537.36 (KHTML, like Gecko) "
@@ -78,38 +91,80 @@ class MercedesMeOAuth(object):
         self.redirect_uri = f'{self.REDIRECT_SERVER_US if country_code == "US" else self.REDIRECT_SERVER}{self.REDIRECT_URI}'
         self.app_name = self.APP_NAME_US if country_code == "US" else self.APP_NAME
         self.token_info = None
+        # pooled connection for the token refreshes, created on first use
+        self._session = None
+        # cookies of the last login
+        self.login_cookies = []
+        self._cache_lock = threading.Lock()
+        # backoff of the failed logins
+        self._login_retry_delay = 0
+        self._login_retry_at = 0
 
     def get_cached_token(self):
         """ Gets a cached auth token
         """
         _LOGGER.debug("start: %s", __name__)
-        token_info = None
-        if self.cache_path:
-            try:
-                token_file = open(self.cache_path)
-                token_info_string = token_file.read()
-                token_file.close()
-                token_info = json.loads(token_info_string)
-
-                if self.is_token_expired(token_info):
-                    _LOGGER.debug("%s - token expired - start refresh", __name__)
-                    token_info = self.refresh_access_token(token_info["refresh_token"])
-
-            except IOError:
-                pass
+        token_info = self._load_cache()
+        if token_info is not None and self.is_token_expired(token_info):
+            _LOGGER.debug("%s - token expired - start refresh", __name__)
+            token_info = self.refresh_access_token(token_info["refresh_token"])
         self.token_info = token_info
         return token_info
 
+    def _load_cache(self):
+        """ Loads the token cache, returns the cached token_info
+        """
+        if not self.cache_path:
+            return None
+        try:
+            with open(self.cache_path) as cache_file:
+                cache = json.load(cache_file)
+        except (IOError, ValueError):
+            return None
+
+        if "version" not in cache:
+            return cache
+        if cache["version"] != TOKEN_CACHE_VERSION:
+            _LOGGER.warning(
+                "unknown token cache version %s in %s", cache["version"], self.cache_path
+            )
+            return None
+
+        self.login_cookies = cache.get("login_cookies", [])
+        return cache.get("token_info")
+
     def _save_token_info(self, token_info):
+        """ Writes the token and the login session to the cache.
+
+        The cache is written to a temporary file first and then moved over
+        the old one, a crash never leaves a half written cache behind.
+        """
         _LOGGER.debug("start: _save_token_info to %s", self.cache_path)
-        if self.cache_path:
+        if not self.cache_path:
+            return
+
+        cache = {
+            "version": TOKEN_CACHE_VERSION,
+            "token_info": token_info,
+            "login_cookies": self.login_cookies,
+        }
+        tmp_path = f"{self.cache_path}.tmp"
+        with self._cache_lock:
             try:
-                token_file = open(self.cache_path, "w")
-                token_file.write(json.dumps(token_info))
-                token_file.close()
+                with open(tmp_path, "w") as cache_file:
+                    json.dump(cache, cache_file)
+                os.replace(tmp_path, self.cache_path)
             except IOError:
                 _LOGGER.warning("couldn't write token cache to %s", self.cache_path)
 
+    @property
+    def session(self):
+        if self._session is None:
+            import requests
+
+            self._session = requests.session()
+        return self._session
+
     def is_token_expired(self, token_info):
         return is_token_expired(token_info)
 
@@ -118,18 +173,9 @@ class MercedesMeOAuth(object):
         """
         _LOGGER.debug("access_token_refresh started - refresh_token: %s", refresh_token)
 
-        headers = {
-            "User-Agent": "okhttp/3.9.0",
-            "Content-Type": "application/x-www-form-urlencoded",
-        }
-
-        url = (
-            f"{self.OAUTH_TOKEN_URL}?grant_type=refresh_token&"
-            f"redirect_uri={self.redirect_uri}&"
-            f"client_id={self.oauth_client_id}&refresh_token={refresh_token}"
-        )
+        url, headers = self._get_refresh_request(refresh_token)
 
-        response = requests.post(
+        response = self.session.post(
             url, data=None, headers=headers, verify=LOGIN_VERIFY_SSL_CERT
         )
 
@@ -142,7 +188,44 @@ class MercedesMeOAuth(object):
                 response.reason,
             )
             return None
-        token_info = response.json()
+        return self._set_refreshed_token(response.json(), refresh_token)
+
+    async def async_refresh_access_token(self, session, refresh_token):
+        """ Gets the new access token using the given aiohttp session
+        """
+        _LOGGER.debug("async access_token_refresh started - refresh_token: %s", refresh_token)
+
+        url, headers = self._get_refresh_request(refresh_token)
+
+        async with session.post(
+            url, headers=headers, ssl=None if LOGIN_VERIFY_SSL_CERT else False
+        ) as response:
+            if response.status != 200:
+                _LOGGER.warning("headers %s", headers)
+                _LOGGER.warning("request %s", response.url)
+                _LOGGER.warning(
+                    "couldn't refresh token: code:%s reason:%s",
+                    response.status,
+                    response.reason,
+                )
+                return None
+            token_info = await response.json()
+        return self._set_refreshed_token(token_info, refresh_token)
+
+    def _get_refresh_request(self, refresh_token):
+        headers = {
+            "User-Agent": "okhttp/3.9.0",
+            "Content-Type": "application/x-www-form-urlencoded",
+        }
+
+        url = (
+            f"{self.OAUTH_TOKEN_URL}?grant_type=refresh_token&"
+            f"redirect_uri={self.redirect_uri}&"
+            f"client_id={self.oauth_client_id}&refresh_token={refresh_token}"
+        )
+        return url, headers
+
+    def _set_refreshed_token(self, token_info, refresh_token):
         token_info = self._add_custom_values_to_token_info(token_info)
         if "refresh_token" not in token_info:
             token_info["refresh_token"] = refresh_token
@@ -160,11 +243,43 @@ class MercedesMeOAuth(object):
         return token_info
 
     def request_initial_token(self):
-        session = requests.session()
-        code_verifier = self._random_string(64)
+        """ Gets a new token, with the login session of the last login if it
+        is still valid, else with the full login.
+
+        After a failed login no login is tried for LOGIN_RETRY_DELAY
+        seconds, doubled per failure up to LOGIN_MAX_RETRY_DELAY. Returns
+        None while the login is backed off.
+        """
+        if time.time() < self._login_retry_at:
+            _LOGGER.debug("login failed before, next try in %.0f seconds",
+                          self._login_retry_at - time.time())
+            return None
+
+        token_info = None
+        try:
+            token_info = self._request_token_with_login_session()
+            if token_info is None:
+                token_info = self._request_token_with_login()
+        finally:
+            self._set_login_result(token_info is not None)
+        return token_info
+
+    def _set_login_result(self, succeeded):
+        if succeeded:
+            self._login_retry_delay = 0
+            self._login_retry_at = 0
+            return
+
+        self._login_retry_delay = min(
+            max(self._login_retry_delay * 2, LOGIN_RETRY_DELAY),
+            LOGIN_MAX_RETRY_DELAY)
+        self._login_retry_at = time.time() + self._login_retry_delay
+        _LOGGER.warning("login failed, next try in %s seconds",
+                        self._login_retry_delay)
+
+    def _get_authorize_request(self, code_verifier):
         code_challenge = self._generate_code_challenge(code_verifier)
 
-        # Start Login Session - Step 1 call API - Result is 302 redirect
         step1_url = (
             f"{self.OAUTH_AUTHORIZE_URL}?"
             + f"response_type=code&"
@@ -181,6 +296,60 @@ class MercedesMeOAuth(object):
             "Accept": "*/*",
             "User-Agent": ANDROID_USERAGENT,
         }
+        return step1_url, step1_headers
+
+    def _request_token_with_login_session(self):
+        """ Gets a token with the cookies of the last login.
+
+        While the login session is valid the authorize request redirects
+        straight to the redirect uri with the OAuth code, the login form
+        and the consent are skipped. Returns None if the session expired.
+        """
+        if not self.login_cookies:
+            return None
+
+        import requests
+
+        _LOGGER.debug("try login with the cached login session")
+        session = requests.session()
+        for cookie in self.login_cookies:
+            session.cookies.set(**cookie)
+
+        # a new PKCE code verifier per authorization request
+        code_verifier = self._random_string(64)
+        url, headers = self._get_authorize_request(code_verifier)
+        for _ in range(5):
+            response = session.get(
+                url,
+                verify=LOGIN_VERIFY_SSL_CERT,
+                headers=headers,
+                allow_redirects=False,
+            )
+            if response.status_code not in [301, 302, 303, 307]:
+                break
+
+            url = response.headers["Location"]
+            if url.startswith(self.redirect_uri):
+                code = parse_qs(urlparse(url).query).get("code")
+                if code:
+                    return self._request_token_with_code(
+                        session, code[0], code_verifier
+                    )
+                break
+
+        _LOGGER.debug("cached login session expired")
+        return None
+
+    def _request_token_with_login(self):
+        # only needed for the rare full login, kept out of the startup
+        import lxml.html
+        import requests
+
+        session = requests.session()
+        code_verifier = self._random_string(64)
+
+        # Start Login Session - Step 1 call API - Result is 302 redirect
+        step1_url, step1_headers = self._get_authorize_request(code_verifier)
 
         # session.proxies.update({'https': 'http://localhost:8866' })
 
@@ -256,38 +425,63 @@ class MercedesMeOAuth(object):
         if step_3_result.status_code == 302:
             location = urlparse(step_3_result.headers["Location"])
             code = parse_qs(location.query).get("code")
+            return self._request_token_with_code(session, code[0], code_verifier)
+        else:
+            _LOGGER.debug("Error getting Access-Token. %s", step_3_result.text)
+
+    def _request_token_with_code(self, session, code, code_verifier):
+        """ Gets the token for an OAuth code and keeps the login session
+        """
+        # Step 4 - Time to get the bearer token :-)
+        step_4_url = (
+            f"{self.OAUTH_TOKEN_URL}?"
+            f"grant_type=authorization_code&"
+            f"redirect_uri={self.redirect_uri}&"
+            f"client_id={self.oauth_client_id}&"
+            f"code_verifier={code_verifier.rstrip('=')}&"
+            f"code={code}"
+        )
+
+        step_4_headers = {
+            "Content-Type": "application/x-www-form-urlencoded",
+            "User-Agent": "okhttp/3.9.0",
+        }
+        step_4_result = session.post(
+            step_4_url,
+            verify=LOGIN_VERIFY_SSL_CERT,
+            headers=step_4_headers,
+            allow_redirects=False,
+            cookies=None,
+        )
+        _LOGGER.debug("Step 4 result: %s", step_4_result.text)
 
-            # Step 4 - Time to get the bearer token :-)
-            step_4_url = (
-                f"{self.OAUTH_TOKEN_URL}?"
-                f"grant_type=authorization_code&"
-                f"redirect_uri={self.redirect_uri}&"
-                f"client_id={self.oauth_client_id}&"
-                f"code_verifier={code_verifier.rstrip('=')}&"
-                f"code={code[0]}"
+        if step_4_result.status_code != 200:
+            _LOGGER.warning(
+                "couldn't get token: code:%s reason:%s",
+                step_4_result.status_code,
+                step_4_result.reason,
             )
+            return None
 
-            step_4_headers = {
-                "Content-Type": "application/x-www-form-urlencoded",
-                "User-Agent": "okhttp/3.9.0",
+        # the next login can skip the login form while the session is valid
+        self.login_cookies = [
+            {
+                "name": cookie.name,
+                "value": cookie.value,
+                "domain": cookie.domain,
+                "path": cookie.path,
+                "secure": cookie.secure,
+                "expires": cookie.expires,
             }
-            step_4_result = session.post(
-                step_4_url,
-                verify=LOGIN_VERIFY_SSL_CERT,
-                headers=step_4_headers,
-                allow_redirects=False,
-                cookies=None,
-            )
-            _LOGGER.debug("Step 4 result: %s", step_4_result.text)
-
-            token_info = step_4_result.json()
-            token_info = self._add_custom_values_to_token_info(token_info)
-            _LOGGER.debug("Step 4 - before Token safe: %s", token_info)
-            self._save_token_info(token_info)
-            self.token_info = token_info
-            return token_info
-        else:
-            _LOGGER.debug("Error getting Access-Token. %s", step_3_result.text)
+            for cookie in session.cookies
+        ]
+
+        token_info = step_4_result.json()
+        token_info = self._add_custom_values_to_token_info(token_info)
+        _LOGGER.debug("Step 4 - before Token safe: %s", token_info)
+        self._save_token_info(token_info)
+        self.token_info = token_info
+        return token_info
 
     def _random_string(self, length=64):
         """Generate a random string of fixed length """
@@ -302,3 +496,150 @@ class MercedesMeOAuth(object):
         return str(base64.urlsafe_b64encode(code_challenge.digest()), "utf-8").rstrip(
             "="
         )
+
+
+def _get_refresh_delay(token_info, margin):
+    """ get the seconds until the next background refresh of a token."""
+    if token_info is None:
+        return TOKEN_RETRY_DELAY
+    return max(token_info["expires_at"] - margin - time.time(), TOKEN_RETRY_DELAY)
+
+
+class TokenManager(object):
+    """ Keeps the access token of a MercedesMeOAuth valid.
+
+    A timer refreshes the token margin seconds before it expires, so the
+    API calls do not wait for a refresh. Only one refresh runs at a time,
+    a caller that needs the token while a refresh is running waits for it
+    and gets the new token.
+    """
+
+    def __init__(self, auth_handler, margin=TOKEN_REFRESH_MARGIN):
+        self.auth_handler = auth_handler
+        self.margin = margin
+        self._single_flight = SingleFlight()
+        self._timer = None
+        self._timer_lock = threading.Lock()
+        self._stopped = False
+
+    def start(self):
+        """ schedule the background refresh of the current token."""
+        with self._timer_lock:
+            self._stopped = False
+        self._schedule(_get_refresh_delay(self.auth_handler.token_info, self.margin))
+
+    def stop(self):
+        """ cancel the background refresh, a refresh running meanwhile does
+        not schedule the next one."""
+        with self._timer_lock:
+            self._stopped = True
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def get_token(self):
+        """ get the token info, refreshes in the request path only if the
+        background refresh did not make it in time."""
+        token_info = self.auth_handler.token_info
+        if token_info is None or is_token_expired(token_info):
+            token_info = self.refresh()
+        return token_info
+
+    def refresh(self):
+        return self._single_flight.do("refresh", self._refresh)
+
+    def _refresh(self):
+        token_info = self.auth_handler.refresh_access_token(
+            self.auth_handler.token_info["refresh_token"]
+        )
+        if token_info is None:
+            _LOGGER.warning("couldn't refresh token, login again")
+            token_info = self.auth_handler.request_initial_token()
+        self._schedule(_get_refresh_delay(token_info, self.margin))
+        return token_info
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception:  # pylint: disable=broad-except
+            _LOGGER.exception("Background token refresh failed")
+            self._schedule(TOKEN_RETRY_DELAY)
+
+    def _schedule(self, delay):
+        with self._timer_lock:
+            if self._stopped:
+                return
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(delay, self._refresh_in_background)
+            self._timer.daemon = True
+            self._timer.start()
+
+
+class AsyncTokenManager(object):
+    """ TokenManager for the AsyncController, must be used in one event loop.
+
+    The token is refreshed with the given aiohttp session.
+    """
+
+    def __init__(self, auth_handler, session, margin=TOKEN_REFRESH_MARGIN):
+        self.auth_handler = auth_handler
+        self.session = session
+        self.margin = margin
+        self._single_flight = AsyncSingleFlight()
+        self._handle = None
+        self._stopped = False
+
+    def start(self):
+        """ schedule the background refresh of the current token."""
+        self._stopped = False
+        self._schedule(_get_refresh_delay(self.auth_handler.token_info, self.margin))
+
+    def stop(self):
+        """ cancel the background refresh, see TokenManager.stop."""
+        self._stopped = True
+        self._cancel()
+
+    def _cancel(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    async def async_get_token(self):
+        """ get the token info, refreshes in the request path only if the
+        background refresh did not make it in time."""
+        token_info = self.auth_handler.token_info
+        if token_info is None or is_token_expired(token_info):
+            token_info = await self.async_refresh()
+        return token_info
+
+    async def async_refresh(self):
+        return await self._single_flight.do("refresh", self._async_refresh)
+
+    async def _async_refresh(self):
+        token_info = await self.auth_handler.async_refresh_access_token(
+            self.session, self.auth_handler.token_info["refresh_token"]
+        )
+        if token_info is None:
+            _LOGGER.warning("couldn't refresh token, login again")
+            token_info = await asyncio.get_event_loop().run_in_executor(
+                None, self.auth_handler.request_initial_token
+            )
+        self._schedule(_get_refresh_delay(token_info, self.margin))
+        return token_info
+
+    async def _async_refresh_in_background(self):
+        try:
+            await self.async_refresh()
+        except Exception:  # pylint: disable=broad-except
+            _LOGGER.exception("Background token refresh failed")
+            self._schedule(TOKEN_RETRY_DELAY)
+
+    def _schedule(self, delay):
+        self._cancel()
+        if self._stopped:
+            return
+        self._handle = asyncio.get_event_loop().call_later(
+            delay,
+            lambda: asyncio.ensure_future(self._async_refresh_in_background()),
+        )
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+""" Motion aware poll scheduling of the Mercedes me cars.
+"""
+
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+# about 50m, smaller location changes are gps noise
+LOCATION_DELTA = 0.0005
+
+# remoteEngine values of a running engine
+ENGINE_RUNNING_STATES = ["RUNNING_FROM_REMOTESTART"]
+
+
+def _get_value(car, category, attrib_name):
+    return getattr(getattr(getattr(car, category, None), attrib_name, None),
+                   "value", None)
+
+
+def get_activity_signals(car):
+    """ get the values that show that a car is driving or charging."""
+    return {
+        "odo": _get_value(car, "odometer", "odo"),
+        "latitude": _get_value(car, "location", "latitude"),
+        "longitude": _get_value(car, "location", "longitude"),
+        "remoteEngine": _get_value(car, "remote_start", "remoteEngine"),
+        "chargingstatus": _get_value(car, "electric", "chargingstatus"),
+    }
+
+
+def is_active(old_signals, new_signals):
+    """ check if the car was active between two refreshes."""
+    if new_signals.get("remoteEngine") in ENGINE_RUNNING_STATES:
+        return True
+
+    for key in ["odo", "remoteEngine", "chargingstatus"]:
+        if old_signals.get(key) != new_signals.get(key):
+            return True
+
+    for key in ["latitude", "longitude"]:
+        old_value = old_signals.get(key)
+        new_value = new_signals.get(key)
+        try:
+            if abs(float(new_value) - float(old_value)) > LOCATION_DELTA:
+                return True
+        except (TypeError, ValueError):
+            if old_value != new_value:
+                return True
+
+    return False
+
+
+class CarPollState(object):
+    def __init__(self, signals, interval, next_poll):
+        self.signals = signals
+        self.interval = interval
+        self.next_poll = next_poll
+
+
+class PollScheduler(object):
+    """ Per car poll intervals based on the observed activity of the car.
+
+    An active car is polled every min_interval seconds. Every refresh
+    without activity multiplies the interval of the car by backoff, up to
+    max_interval seconds for a parked car.
+    """
+    def __init__(self, min_interval, max_interval, backoff=2):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.backoff = backoff
+        self._cars = {}
+
+    def is_due(self, car_id, now):
+        state = self._cars.get(car_id)
+        if state is None:
+            return True
+
+        # The refresh ticks are min_interval apart and do not exactly
+        # match next_poll, round to the closest tick.
+        return now + self.min_interval / 2 >= state.next_poll
+
+    def mark_active(self, car_id):
+        """ poll the car with the shortest interval from the next tick on."""
+        state = self._cars.get(car_id)
+        if state is not None:
+            state.interval = self.min_interval
+            state.next_poll = 0
+
+    def record(self, car, now):
+        """ update the poll interval of a car after it was refreshed."""
+        signals = get_activity_signals(car)
+        state = self._cars.get(car.finorvin)
+
+        if state is None:
+            state = CarPollState(signals, self.min_interval, 0)
+            self._cars[car.finorvin] = state
+        elif is_active(state.signals, signals):
+            state.interval = self.min_interval
+        else:
+            state.interval = min(state.interval * self.backoff,
+                                 self.max_interval)
+
+        state.signals = signals
+        state.next_poll = now + state.interval
+
+        _LOGGER.debug("next poll of %s in %s seconds",
+                      car.finorvin, state.interval)
+        return state.interval
+
+    def forget(self, car_id):
+        self._cars.pop(car_id, None)
@@ -9,9 +9,14 @@ import logging
 from homeassistant.const import (
     LENGTH_KILOMETERS,
     LENGTH_MILES)
+from homeassistant.core import callback
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from homeassistant.util import distance
 
-from custom_components.mercedesmeapi import DOMAIN, MercedesMeEntity
+from custom_components.mercedesmeapi import (
+    DOMAIN,
+    SIGNAL_ADD_ENTITIES,
+    MercedesMeEntity)
 from .const import SENSORS
 
 DEPENDENCIES = ['mercedesmeapi']
@@ -27,32 +32,52 @@ async def async_setup_platform(hass, config, async_add_devices,
 
     data = hass.data[DOMAIN].data
 
+    @callback
+    def async_add_car_devices(vin, features):
+        """Add the sensors of features activated after the setup."""
+        car = data.get_car(vin)
+        if car is not None:
+            async_add_devices(_get_devices(hass, data, car, features), True)
+
+    async_dispatcher_connect(hass, SIGNAL_ADD_ENTITIES, async_add_car_devices)
+
     if not data.cars:
         _LOGGER.info("No Cars found.")
         return
 
     devices = []
     for car in data.cars:
-        for key, value in sorted(SENSORS.items()):
-            if value[5] is None or getattr(car.features, value[5]) is True:
-                device = MercedesMESensor(
-                    hass,
-                    data,
-                    key,
-                    value[0],
-                    car.finorvin,
-                    value[1],
-                    car.licenseplate,
-                    value[2],
-                    value[3],
-                    value[4],
-                    value[6])
-                if device.device_retrieval_status() in ["VALID", "NOT_RECEIVED"] :
-                    devices.append(device)
+        devices.extend(_get_devices(hass, data, car))
 
     async_add_devices(devices, True)
 
 
+def _get_devices(hass, data, car, features=None):
+    """Get the sensors of a car, only the ones of the given features if set."""
+    devices = []
+    for key, value in sorted(SENSORS.items()):
+        if features is not None and value[5] not in features:
+            continue
+
+        if value[5] is None or getattr(car.features, value[5]) is True:
+            device = MercedesMESensor(
+                hass,
+                data,
+                key,
+                value[0],
+                car.finorvin,
+                value[1],
+                car.licenseplate,
+                value[2],
+                value[3],
+                value[4],
+                value[6])
+            if device.device_retrieval_status() in ["VALID", "NOT_RECEIVED"] :
+                devices.append(device)
+
+    return devices
+
+
 class MercedesMESensor(MercedesMeEntity):
     """Representation of a Sensor."""
 
@@ -63,8 +88,12 @@ class MercedesMESensor(MercedesMeEntity):
         if self.device_retrieval_status == "NOT_RECEIVED":
             return "NOT_RECEIVED"
 
-        if self._unit == LENGTH_KILOMETERS and \
-           not self._hass.config.units.is_metric:
+        is_metric = self._hass.config.units.is_metric
+        return self._get_rendered(("state", is_metric),
+                                  lambda: self._render_state(is_metric))
+
+    def _render_state(self, is_metric):
+        if self._unit == LENGTH_KILOMETERS and not is_metric:
             return round(
                 distance.convert(self._state, LENGTH_KILOMETERS, LENGTH_MILES))
         else:
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+""" Coalescing of duplicate calls.
+"""
+
+import asyncio
+import threading
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """ Runs one call per key at a time.
+
+    A caller that arrives while a call of the same key is in flight waits
+    for it and shares its result (or exception) instead of calling again.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args, **kwargs)
+        except Exception as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+
+class AsyncSingleFlight(object):
+    """ SingleFlight for coroutine functions, must be used in one event loop.
+    """
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, function, *args, **kwargs):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(function(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+
+        # a cancelled caller does not cancel the call of the other callers
+        return await asyncio.shield(task)
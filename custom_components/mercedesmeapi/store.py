@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+""" Columnar state store of the Mercedes me cars.
+"""
+
+from array import array
+import math
+import threading
+
+# compares equal to itself, unlike nan, so rows can be diffed
+NO_TIMESTAMP = -math.inf
+
+VALUES = 0
+STATUSES = 1
+TIMESTAMPS = 2
+
+
+class AttributeView(object):
+    """ CarAttribute compatible view on one attribute of a car."""
+    __slots__ = ("_store", "_row", "_column")
+
+    def __init__(self, store, row, column):
+        self._store = store
+        self._row = row
+        self._column = column
+
+    @property
+    def value(self):
+        return self._row[VALUES][self._column]
+
+    @property
+    def retrievalstatus(self):
+        return self._store.get_status(self._row, self._column)
+
+    @property
+    def timestamp(self):
+        return self._store.get_timestamp(self._row, self._column)
+
+
+class CategoryView(object):
+    """ Category object (Odometer, Doors, ...) of a car on top of the store.
+
+    The view reads the row of the car that was published when the view was
+    created, all its attributes come from the same refresh. Attribute views
+    are created on first access and then reused.
+    """
+    __slots__ = ("name", "_store", "_row", "_columns", "_attributes")
+
+    def __init__(self, name, store, row, columns):
+        self.name = name
+        self._store = store
+        self._row = row
+        self._columns = columns
+        self._attributes = {}
+
+    def __getattr__(self, attrib_name):
+        try:
+            return self._attributes[attrib_name]
+        except KeyError:
+            pass
+
+        column = self._columns.get(attrib_name)
+        if column is None:
+            raise AttributeError(attrib_name)
+
+        attribute = AttributeView(self._store, self._row, column)
+        self._attributes[attrib_name] = attribute
+        return attribute
+
+
+class FleetStore(object):
+    """ Columnar state of all cars of the account.
+
+    Every attribute name gets a column. Each car owns a slot with a row of
+    values, retrieval status codes and timestamps. Attributes shared by
+    several categories (e.g. warninglowbattery) share their column.
+
+    A published row is never changed. update_row copies the row of the car,
+    applies the changes and publishes the copy with a single assignment, so
+    readers never block and never see a half updated car. Writers of the
+    same car have to be serialized by the caller.
+
+    Attributes:
+        categories (dict): category: (name, options)
+    """
+    def __init__(self, categories):
+        self.categories = {}
+        self.columns = {}
+        for category, (name, options) in categories.items():
+            category_columns = {}
+            for option in options:
+                category_columns[option] = self.columns.setdefault(
+                    option, len(self.columns))
+            self.categories[category] = (name, category_columns)
+
+        self.column_names = list(self.columns)
+        self.width = len(self.columns)
+        # slot: (values, statuses, timestamps)
+        self.rows = []
+        self.car_ids = []
+        self._slots = {}
+        self._free_slots = []
+
+        # retrieval status: code, 0 is None
+        self._status_codes = {None: 0}
+        self._status_names = [None]
+        self._status_lock = threading.Lock()
+
+        # frozenset of categories: {option: column}
+        self._merged_columns = {}
+
+    def add_car(self, car_id):
+        """ get the slot of a car, a new car gets a preallocated row."""
+        slot = self._slots.get(car_id)
+        if slot is not None:
+            return slot
+
+        row = ([None] * self.width,
+               array("H", [0]) * self.width,
+               array("d", [NO_TIMESTAMP]) * self.width)
+
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self.rows[slot] = row
+            self.car_ids[slot] = car_id
+        else:
+            slot = len(self.car_ids)
+            self.rows.append(row)
+            self.car_ids.append(car_id)
+
+        self._slots[car_id] = slot
+        return slot
+
+    def remove_car(self, car_id):
+        slot = self._slots.pop(car_id, None)
+        if slot is None:
+            return
+
+        self.rows[slot] = None
+        self.car_ids[slot] = None
+        self._free_slots.append(slot)
+
+    def get_category(self, slot, category):
+        """ get a view of a category on the current row of a car."""
+        name, columns = self.categories[category]
+        return CategoryView(name, self, self.rows[slot], columns)
+
+    def get_columns(self, categories):
+        """ get {option: column} of several categories, options shared by
+        the categories are listed once."""
+        key = frozenset(categories)
+        columns = self._merged_columns.get(key)
+        if columns is None:
+            columns = {}
+            for category in key:
+                columns.update(self.categories[category][1])
+            self._merged_columns[key] = columns
+        return columns
+
+    def get_status(self, row, column):
+        return self._status_names[row[STATUSES][column]]
+
+    def get_timestamp(self, row, column):
+        timestamp = row[TIMESTAMPS][column]
+        if timestamp == NO_TIMESTAMP:
+            return None
+        if timestamp.is_integer():
+            return int(timestamp)
+        return timestamp
+
+    def update_row(self, slot, updates):
+        """ publish a new row of a car.
+
+        updates is {column: (value, status code, timestamp value)} of the
+        changed attributes. Returns the names of the changed attributes.
+        """
+        if not updates:
+            return set()
+
+        values, statuses, timestamps = self.rows[slot]
+        values = list(values)
+        statuses = array("H", statuses)
+        timestamps = array("d", timestamps)
+        for column, (value, status, timestamp) in updates.items():
+            values[column] = value
+            statuses[column] = status
+            timestamps[column] = timestamp
+
+        self.rows[slot] = (values, statuses, timestamps)
+        return {self.column_names[column] for column in updates}
+
+    def get_update(self, slot, column, value, retrievalstatus, timestamp):
+        """ get the update of an attribute, None if it did not change."""
+        status = self.get_status_code(retrievalstatus)
+        timestamp = self.get_timestamp_value(timestamp)
+
+        values, statuses, timestamps = self.rows[slot]
+        if values[column] == value and statuses[column] == status and \
+           timestamps[column] == timestamp:
+            return None
+        return (value, status, timestamp)
+
+    def dump_row(self, slot):
+        """ get the set attributes of a car,
+        {attrib_name: (value, retrievalstatus, timestamp)}."""
+        row = self.rows[slot]
+        values, statuses, _ = row
+        return {name: (values[column], self._status_names[statuses[column]],
+                       self.get_timestamp(row, column))
+                for name, column in self.columns.items()
+                if values[column] is not None or statuses[column] != 0}
+
+    def load_row(self, slot, attributes):
+        """ publish a row out of dump_row, unknown attributes are skipped.
+        Returns the names of the changed attributes."""
+        updates = {}
+        for name, (value, retrievalstatus, timestamp) in attributes.items():
+            column = self.columns.get(name)
+            if column is None:
+                continue
+            update = self.get_update(slot, column, value, retrievalstatus,
+                                     timestamp)
+            if update is not None:
+                updates[column] = update
+        return self.update_row(slot, updates)
+
+    def scan(self, attrib_name):
+        """ get the value of an attribute for all cars, {car_id: value}."""
+        column = self.columns[attrib_name]
+        return {car_id: row[VALUES][column]
+                for row, car_id in zip(self.rows, self.car_ids)
+                if car_id is not None}
+
+    def get_status_code(self, retrievalstatus):
+        code = self._status_codes.get(retrievalstatus)
+        if code is not None:
+            return code
+
+        # writers of different cars can add a status at the same time
+        with self._status_lock:
+            code = self._status_codes.get(retrievalstatus)
+            if code is None:
+                self._status_names.append(retrievalstatus)
+                code = len(self._status_names) - 1
+                self._status_codes[retrievalstatus] = code
+        return code
+
+    def get_timestamp_value(self, timestamp):
+        if timestamp is None:
+            return NO_TIMESTAMP
+        try:
+            return float(timestamp)
+        except (TypeError, ValueError):
+            return NO_TIMESTAMP
@@ -5,11 +5,17 @@ For more details about this component, please refer to the documentation at
 https://github.com/ReneNulschDE/mbapipy/
 """
 import logging
+from functools import partial
 
 from homeassistant.components.switch import SwitchEntity
 from homeassistant.const import STATE_OFF, STATE_ON
+from homeassistant.core import callback
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
 
-from custom_components.mercedesmeapi import DOMAIN, MercedesMeEntity
+from custom_components.mercedesmeapi import (
+    DOMAIN,
+    SIGNAL_ADD_ENTITIES,
+    MercedesMeEntity)
 from .const import SWITCHES
 
 DEPENDENCIES = ['mercedesmeapi']
@@ -25,35 +31,61 @@ async def async_setup_platform(hass, config, async_add_devices,
 
     data = hass.data[DOMAIN].data
 
+    @callback
+    def async_add_car_devices(vin, features):
+        """Add the switches of features activated after the setup."""
+        car = data.get_car(vin)
+        if car is not None:
+            async_add_devices(_get_devices(hass, data, car, features), True)
+
+    async_dispatcher_connect(hass, SIGNAL_ADD_ENTITIES, async_add_car_devices)
+
     if not data.cars:
         _LOGGER.info("No Cars found.")
         return
 
     devices = []
     for car in data.cars:
-        for key, value in sorted(SWITCHES.items()):
-            if value[5] is None or getattr(car.features, value[5]) is True:
-                devices.append(
-                    MercedesMESwitch(
-                        hass=hass,
-                        data=data,
-                        internal_name=key,
-                        sensor_name=value[0],
-                        vin=car.finorvin,
-                        unit=value[1],
-                        licenseplate=car.licenseplate,
-                        feature_name=value[2],
-                        object_name=value[3],
-                        attrib_name=value[4],
-                        extended_attributes=value[6],
-                        switch_action=value[7]))
+        devices.extend(_get_devices(hass, data, car))
 
     async_add_devices(devices, True)
 
 
+def _get_devices(hass, data, car, features=None):
+    """Get the switches of a car, only the ones of the given features if set."""
+    devices = []
+    for key, value in sorted(SWITCHES.items()):
+        if features is not None and value[5] not in features:
+            continue
+
+        if value[5] is None or getattr(car.features, value[5]) is True:
+            devices.append(
+                MercedesMESwitch(
+                    hass=hass,
+                    data=data,
+                    internal_name=key,
+                    sensor_name=value[0],
+                    vin=car.finorvin,
+                    unit=value[1],
+                    licenseplate=car.licenseplate,
+                    feature_name=value[2],
+                    object_name=value[3],
+                    attrib_name=value[4],
+                    extended_attributes=value[6],
+                    switch_action=value[7]))
+
+    return devices
+
+
 class MercedesMESwitch(MercedesMeEntity, SwitchEntity):
     """Representation of a Sensor."""
 
+    @property
+    def command_actions(self):
+        """Return the command actions whose status the entity shows."""
+        switch_action = self._kwargs.get('switch_action', None)
+        return (f"{switch_action}_on", f"{switch_action}_off")
+
     @property
     def is_on(self):
         """Get whether the lock is in locked state."""
@@ -64,7 +96,7 @@ class MercedesMESwitch(MercedesMeEntity, SwitchEntity):
         _LOGGER.debug("turn off %s for: %s",
                       self._kwargs.get('switch_action', None), self._name)
 
-        self._data.switch_car_feature(
+        return self._data.switch_car_feature(
             action='%s_off' % self._kwargs.get('switch_action', None),
             car_id=self._vin)
 
@@ -73,13 +105,51 @@ class MercedesMESwitch(MercedesMeEntity, SwitchEntity):
         _LOGGER.debug("turn on %s for: %s",
                       self._kwargs.get('switch_action', None), self._name)
 
-        self._data.switch_car_feature(
+        return self._data.switch_car_feature(
             action='%s_on' % self._kwargs.get('switch_action', None),
             car_id=self._vin)
 
+    async def async_turn_off(self, **kwargs):
+        """Send the lock command."""
+        if not self._data.is_async:
+            await self._async_send_command(
+                STATE_OFF, self.hass.async_add_executor_job, self.turn_off)
+            return
+
+        _LOGGER.debug("turn off %s for: %s",
+                      self._kwargs.get('switch_action', None), self._name)
+
+        await self._async_send_command(
+            STATE_OFF, partial(
+                self._data.async_switch_car_feature,
+                action='%s_off' % self._kwargs.get('switch_action', None),
+                car_id=self._vin))
+
+    async def async_turn_on(self, **kwargs):
+        """Send the unlock command."""
+        if not self._data.is_async:
+            await self._async_send_command(
+                STATE_ON, self.hass.async_add_executor_job, self.turn_on)
+            return
+
+        _LOGGER.debug("turn on %s for: %s",
+                      self._kwargs.get('switch_action', None), self._name)
+
+        await self._async_send_command(
+            STATE_ON, partial(
+                self._data.async_switch_car_feature,
+                action='%s_on' % self._kwargs.get('switch_action', None),
+                car_id=self._vin))
+
     @property
     def state(self):
         """Return the state of the sensor."""
+        if self._optimistic_state is not None:
+            return self._optimistic_state
+
+        return self._get_device_state()
+
+    def _get_device_state(self):
         if self._kwargs.get('switch_action', None) == 'climate':
             return STATE_OFF if self._state == 'INACTIVE' else STATE_ON
 